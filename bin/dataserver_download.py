@@ -4,24 +4,52 @@ NOAA GFS: https://registry.opendata.aws/noaa-gfs-bdp-pds/
 NOAA GEFS: https://registry.opendata.aws/noaa-gefs/
 """
 import concurrent.futures
-from datetime import datetime
+import itertools
+from datetime import datetime, time as dt_time, timedelta
+import multiprocessing
 import time
 import os
-import subprocess
-import schedule
-from ratelimiter import RateLimiter
+import random
+import threading
+import boto3
+from botocore import UNSIGNED
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from dataserver.logger import logger
 from dataserver.process import process, process_gfs_file, process_gefs_file
 
 
-# It turns out that multiple threads easily run out of memory on AWS EC2.
-MAX_WORKERS = 1
-REQUEST_INTERVAL = 6
-SCHEDULE_CHECK_INTERVAL = 300
-RETRY_TIME = 1800
+# Downloads are bound by S3 latency rather than CPU, so many files are
+# fetched concurrently.
+MAX_WORKERS = 24
+# GRIB parsing is CPU bound and holds the GIL, so it runs in separate
+# processes while download threads keep the network busy. Each process
+# decodes whole GRIB messages, and AWS EC2 instances easily run out of memory,
+# so only a few run at once.
+PROCESS_WORKERS = min(2, os.cpu_count() or 1)
+# WARNING: Data for 00:00, 06:00, 12:00, 18:00 UTC, which are
+# uploaded around 4 hours later. Default timezone used by AWS EC2
+# is UTC, whereas local machines have default timezones corresponding
+# to their local timezones.
+JOB_TIMES = [dt_time(4), dt_time(10), dt_time(16), dt_time(22)]
+# Retry passes sleep for a random time in [0, min(cap, base * 2^attempt)].
+RETRY_BASE_TIME = 30
+RETRY_MAX_TIME = 1800
 MAX_RETRY = 10
 MAX_PREDICTION_HOURS = 72
-rate_limiter = RateLimiter(max_calls=MAX_WORKERS, period=REQUEST_INTERVAL)
+# NOAA buckets are public, so requests don't need to be signed. The client is
+# created once and shared by all `downloader` threads (boto3 clients are
+# thread-safe), which reuses its connection pool across downloads.
+S3_CLIENT = boto3.client(
+    "s3", config=Config(
+        signature_version=UNSIGNED,
+        max_pool_connections=64,
+        # Hung sockets should fail fast instead of stalling a worker.
+        connect_timeout=10,
+        read_timeout=60,
+        retries={"max_attempts": 5, "mode": "adaptive"},
+    )
+)
 
 
 def get_current_time(current_date):
@@ -40,17 +68,15 @@ def get_current_time(current_date):
     """
     working_directory = os.getcwd()
     directory = f"{working_directory}/data/{current_date}"
-    # Folder for current_date doesn't exist, time is 00.
-    if not os.path.exists(directory):
-        os.mkdir(directory)
-        os.mkdir(f"{directory}/00")
-        return "00"
+    try:
+        with os.scandir(directory) as entries:
+            existing_times = {entry.name for entry in entries}
+    except FileNotFoundError:
+        existing_times = set()
     # Return the first non-existent time.
-    times = ["06", "12", "18"]
-    for timestamp in times:
-        next_directory = f"{directory}/{timestamp}"
-        if not os.path.exists(next_directory):
-            os.mkdir(next_directory)
+    for timestamp in ["00", "06", "12", "18"]:
+        if timestamp not in existing_times:
+            os.makedirs(f"{directory}/{timestamp}", exist_ok=True)
             return timestamp
     raise ValueError("Current directory has all four times.")
 
@@ -64,49 +90,235 @@ def get_urls(current_date, current_time):
     return urls
 
 
-def downloader(file_transfer_info, file_list):
+def backoff(attempt):
+    """Return seconds to sleep before retry pass `attempt`.
+
+    Truncated exponential backoff with full jitter: a missing file that shows
+    up shortly after the first pass is picked up within seconds, whereas a
+    real outage still backs off up to RETRY_MAX_TIME.
+    """
+    upper_bound = min(RETRY_MAX_TIME, RETRY_BASE_TIME * 2 ** attempt)
+    return random.uniform(0, upper_bound)
+
+
+def parse_s3_url(url):
+    """Split an S3 url into a tuple of (bucket, key).
+
+    E.g. s3://noaa-gfs-bdp-pds/gfs.20770101/00/atmos/gfs.t00z.pgrb2.0p25.f000
+    -> (noaa-gfs-bdp-pds, gfs.20770101/00/atmos/gfs.t00z.pgrb2.0p25.f000)
+    """
+    if not url.startswith("s3://"):
+        raise ValueError(f"Invalid S3 url: {url}")
+    bucket, _, key = url[len("s3://"):].partition("/")
+    return (bucket, key)
+
+
+def list_keys(url):
+    """Return the set of S3 keys under the prefix `url`.
+
+    One paginated listing replaces a blind GET per file, so files that are
+    not uploaded yet are skipped instead of failing.
+
+    Parameter:
+    url - s3://bucket/prefix, e.g. one of the urls from get_urls.
+    """
+    bucket, prefix = parse_s3_url(url)
+    paginator = S3_CLIENT.get_paginator("list_objects_v2")
+    return {
+        content["Key"]
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/")
+        for content in page.get("Contents", [])
+    }
+
+
+def get_available_files(pending, urls):
+    """Return files in `pending` that have been uploaded to S3.
+
+    A prefix that cannot be listed, e.g. because of a network error, is
+    treated as having no files yet, so that the files are retried on the
+    next pass.
+
+    Parameters:
+    pending - a dictionary {dest_dir: (src_url, dest_dir)}.
+    urls - {"gfs": gfs_url, "gefs": gefs_url} from get_urls.
+    """
+    keys = set()
+    for url in urls.values():
+        try:
+            keys |= list_keys(url)
+        except (ClientError, BotoCoreError) as error:
+            logger.exception(
+                f"Error occurred: {error}\n"
+                f"Source prefix: {url}"
+            )
+    return [
+        file_transfer_info for file_transfer_info in pending.values()
+        if parse_s3_url(file_transfer_info[0])[1] in keys
+    ]
+
+
+def process_raw_file(dest_dir):
+    """Extract data from a downloaded GFS or GEFS file based on its name."""
+    # pylint: disable=C0207
+    filename = dest_dir.split("/")[-1]  # gfs.fxxx or gefs.fxxx
+    file_type = filename.split(".")[0]
+    if file_type == "gfs":
+        process_gfs_file(dest_dir)
+    else:
+        assert file_type == "gefs"
+        process_gefs_file(dest_dir)
+
+
+class GribProcessPool:
+    """Pool of processes that parse downloaded GRIB files.
+
+    Workers are started by a fork server instead of forking this process,
+    which runs download threads and the log listener thread. If a worker dies,
+    e.g. because it runs out of memory, the pool is broken for good: the
+    files being processed fail, and the next file starts a new pool.
+    """
+
+    def __init__(self, max_workers=PROCESS_WORKERS):
+        """Start a pool with at most `max_workers` processes."""
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+    def _create_executor(self):
+        """Return a new ProcessPoolExecutor."""
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("forkserver")
+        )
+
+    def process_file(self, dest_dir):
+        """Process a downloaded file in a worker and wait for it."""
+        executor = self._executor
+        try:
+            executor.submit(process_raw_file, dest_dir).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            with self._lock:
+                # Other threads may have replaced the broken pool already.
+                if self._executor is executor:
+                    logger.warning("Process pool broken. Starting a new one.")
+                    executor.shutdown(wait=False)
+                    self._executor = self._create_executor()
+            raise
+
+    def shutdown(self):
+        """Wait for pending files and stop the workers."""
+        self._executor.shutdown()
+
+    def __enter__(self):
+        """Return the pool itself."""
+        return self
+
+    def __exit__(self, *_):
+        """Shut down the pool."""
+        self.shutdown()
+
+
+def downloader(file_transfer_info, process_pool=None):
     """Download one dataset.
 
     This is a worker thread that downloads only one file. Upon success, it
-    extracts the information from the file, removes the large raw file, and
-    removes the file info from the list of all files.
+    extracts the information from the file and removes the large raw file.
 
     Parameters:
     file_transfer_info - (src_url, dest_dir) a tuple of source url and
         destination directory path.
-    file_list - a SET of file_transfer_info. Current info is removed after
-        download is successful.
+    process_pool - an optional GribProcessPool that processes the file
+        outside of this thread. The file is processed in this thread if it
+        is None.
+
+    Return:
+    True if the file is downloaded and processed, False otherwise.
     """
-    with rate_limiter:
-        src_url, dest_dir = file_transfer_info
-        src_url = str(src_url)
-        dest_dir = str(dest_dir)
+    src_url, dest_dir = file_transfer_info
+    src_url = str(src_url)
+    dest_dir = str(dest_dir)
+    try:
+        bucket, key = parse_s3_url(src_url)
+        S3_CLIENT.download_file(bucket, key, dest_dir)
+        # NOTE: process the file right after download to save storage space
+        if process_pool is None:
+            process_raw_file(dest_dir)
+        else:
+            process_pool.process_file(dest_dir)
+        # Current file is finished downloading and processing.
+        return True
+    except ClientError as error:
+        logger.exception(
+            f"Error occurred: {error}\n"
+            f"Source file: {src_url}"
+        )
+    except Exception as error:
+        logger.exception(
+            f"Unexpected error: {error}\n"
+            f"Source file: {src_url}"
+        )
+    finally:
+        # Processing functions delete the raw file on success. Make sure a
+        # failed attempt doesn't leave it on disk either, since the file is
+        # downloaded again on retry.
         try:
-            subprocess.check_output(
-                ["aws", "s3", "cp", "--no-sign-request", src_url, dest_dir],
-                stderr=subprocess.STDOUT
-            )
-            # NOTE: process the file right after download to save storage space
-            # pylint: disable=C0207
-            filename = dest_dir.split("/")[-1]  # gfs.fxxx or gefs.fxxx
-            file_type = filename.split(".")[0]
-            if file_type == "gfs":
-                process_gfs_file(str(dest_dir))
-            else:
-                assert file_type == "gefs"
-                process_gefs_file(str(dest_dir))
-            # Current file is finished downloading and processing.
-            file_list.remove(file_transfer_info)
-        except subprocess.CalledProcessError as error:
-            logger.exception(
-                f"Error occurred: {error.output.decode('utf-8')}\n"
-                f"Source file: {src_url}"
-            )
-        except Exception as error:
-            logger.exception(
-                f"Unexpected error: {error}\n"
-                f"Source file: {src_url}"
-            )
+            os.unlink(dest_dir)
+        except FileNotFoundError:
+            pass
+    return False
+
+
+def get_pending_files(current_date, current_time, urls):
+    """Return files to download, keyed by destination path.
+
+    Values are (source url, destination path) pairs passed to downloader.
+    """
+    # Fill forecast hours into fixed templates instead of formatting the
+    # whole url for every file.
+    gfs_src = f"{urls['gfs']}/gfs.t{current_time}z.pgrb2.0p25.f%03d".__mod__
+    gefs_src = (
+        f"{urls['gefs']}/gefs.chem.t{current_time}z.a2d_0p25.f%03d.grib2"
+    ).__mod__
+    gfs_dest = f"data/{current_date}/{current_time}/gfs/gfs.f%03d".__mod__
+    gefs_dest = f"data/{current_date}/{current_time}/gefs/gefs.f%03d".__mod__
+
+    # GFS data are hourly predictions.
+    gfs_file_transfer_info = \
+        [(gfs_src(hour), gfs_dest(hour))
+         for hour in range(MAX_PREDICTION_HOURS)]
+    # GEFS data have 3-hour intervals.
+    gefs_file_transfer_info = \
+        [(gefs_src(hour), gefs_dest(hour))
+         for hour in range(0, MAX_PREDICTION_HOURS, 3)]
+
+    return {
+        dest_dir: (src_url, dest_dir) for src_url, dest_dir in
+        itertools.chain(gfs_file_transfer_info, gefs_file_transfer_info)
+    }
+
+
+def submit_downloads(executor, process_pool, available_files):
+    """Submit available files to executor.
+
+    Return a dict from futures to the destination paths of their files.
+    """
+    return {
+        executor.submit(
+            downloader, file_transfer_info, process_pool
+        ): file_transfer_info[1]
+        for file_transfer_info in available_files
+    }
+
+
+def collect_downloads(futures, pending):
+    """Wait for futures and remove files downloaded from pending.
+
+    Only the main thread updates pending. Each future is guaranteed to
+    return since exceptions are handled inside downloader function.
+    """
+    for future in concurrent.futures.as_completed(futures):
+        if future.result():
+            del pending[futures[future]]
 
 
 def download_data():
@@ -122,61 +334,59 @@ def download_data():
         f"Start downloading data for {current_date}/{current_time}"
     )
 
-    os.mkdir(f"data/{current_date}/{current_time}/gfs")
-    os.mkdir(f"data/{current_date}/{current_time}/gefs")
+    os.makedirs(f"data/{current_date}/{current_time}/gfs", exist_ok=True)
+    os.makedirs(f"data/{current_date}/{current_time}/gefs", exist_ok=True)
 
     urls = get_urls(current_date, current_time)
-    gfs_url, gefs_url = urls["gfs"], urls["gefs"]
-
-    # GFS data are hourly predictions.
-    gfs_file_transfer_info = \
-        [(f"{gfs_url}/gfs.t{current_time}z.pgrb2.0p25.f{hour:03d}",
-          f"data/{current_date}/{current_time}/gfs/gfs.f{hour:03d}")
-         for hour in range(MAX_PREDICTION_HOURS)]
-    # GEFS data have 3-hour intervals.
-    gefs_file_transfer_info = \
-        [(f"{gefs_url}/gefs.chem.t{current_time}z.a2d_0p25.f{hour:03d}."
-          "grib2",
-          f"data/{current_date}/{current_time}/gefs/gefs.f{hour:03d}")
-         for hour in range(0, MAX_PREDICTION_HOURS, 3)]
-
-    file_list = set(gfs_file_transfer_info) | set(gefs_file_transfer_info)
+    # Files left to download, keyed by destination path.
+    pending = get_pending_files(current_date, current_time, urls)
 
     retry_counter = 0
-    while len(file_list) > 0 and retry_counter < MAX_RETRY:
-        # Copy file list for enumeration to avoid undefined behavior.
-        file_list_copy = file_list.copy()
-        with concurrent.futures.ThreadPoolExecutor(
-          max_workers=MAX_WORKERS) as executor:
-            # Each future inside list _ is guaranteed success since exceptions
-            # are handled inside downloader function.
-            _ = [executor.submit(
-                downloader, file_transfer_info, file_list
-            ) for file_transfer_info in file_list_copy]
-        if len(file_list) == 0:
-            logger.info(
-                f"{current_date}/{current_time} download complete."
+    # Transient S3 errors are retried inside the client. The passes below
+    # only pick up files that are not uploaded yet, so the pools are created
+    # once and reused by every pass. A broken process pool replaces itself.
+    with concurrent.futures.ThreadPoolExecutor(
+      max_workers=MAX_WORKERS) as executor, \
+            GribProcessPool() as process_pool:
+        while len(pending) > 0 and retry_counter < MAX_RETRY:
+            # Files not uploaded yet stay in pending for the next pass.
+            collect_downloads(
+                submit_downloads(
+                    executor, process_pool,
+                    get_available_files(pending, urls)
+                ),
+                pending
             )
-            process(current_date, current_time)
-            return
-        retry_counter += 1
-        logger.warning(
-            f"{current_date}/{current_time} retry # {retry_counter}"
-        )
-        time.sleep(RETRY_TIME)
+            if len(pending) == 0:
+                logger.info(
+                    f"{current_date}/{current_time} download complete."
+                )
+                process(current_date, current_time)
+                return
+            retry_counter += 1
+            logger.warning(
+                f"{current_date}/{current_time} retry # {retry_counter}"
+            )
+            time.sleep(backoff(retry_counter))
     logger.critical(
         f"{current_date}/{current_time} download failed."
     )
 
 
-if __name__ == "__main__":
-    # WARNING: Data for 00:00, 06:00, 12:00, 18:00 UTC, which are
-    # uploaded around 4 hours later. Default timezone used by AWS EC2
-    # is UTC, whereas local machines have default timezones corresponding
-    # to their local timezones.
-    for job_time in ["04:00", "10:00", "16:00", "22:00"]:
-        schedule.every().day.at(job_time).do(download_data)
+def get_next_run(now):
+    """Return the datetime of the first job in JOB_TIMES after `now`."""
+    return min(
+        datetime.combine(
+            now.date() + timedelta(days=int(job_time <= now.time())),
+            job_time
+        )
+        for job_time in JOB_TIMES
+    )
 
+
+if __name__ == "__main__":
+    # Sleep until the next job instead of polling a scheduler.
     while True:
-        schedule.run_pending()
-        time.sleep(SCHEDULE_CHECK_INTERVAL)  # check for job every 5 minutes
+        current = datetime.now()
+        time.sleep((get_next_run(current) - current).total_seconds())
+        download_data()
@@ -1,5 +1,5 @@
 """Fetch transparency data from dataserver."""
-import subprocess
+import requests
 
 
 USERNAME = "admin"
@@ -7,25 +7,41 @@ with open("api_token.txt", encoding="utf-8") as file:
     token = file.readline().rstrip()
 
 
-if __name__ == "__main__":
+def get_url(request_type, lat, lng, park_id):
+    """Return the API url for the given type of data."""
+    if request_type == "f" or request_type == "forecast":
+        return "http://localhost:9000/api/transparency-forecast/" \
+            f"?lat={lat}&lng={lng}&park_id={park_id}&test=1"
+    if request_type == "h" or request_type == "history":
+        return "http://localhost:9000/api/historical-transparency/" \
+            f"?lat={lat}&lng={lng}&park_id={park_id}&test=1"
+    raise ValueError("Invalid type entered.")
+
+
+def fetch(session):
+    """Prompt for one query and print the response."""
     request_type = input("Type of data to fetch: (forecast(f) | history(h)) ")
     lat = input("Latitude: ")
     lng = input("Longitude: ")
     park_id = input("park_id: ")
 
-    url = "/"
-    if request_type == "f" or request_type == "forecast":
-        url = "http://localhost:9000/api/transparency-forecast/" \
-            f"?lat={lat}&lng={lng}&park_id={park_id}&test=1"
-    elif request_type == "h" or request_type == "history":
-        url = "http://localhost:9000/api/historical-transparency/" \
-            f"?lat={lat}&lng={lng}&park_id={park_id}&test=1"
-    else:
-        raise ValueError("Invalid type entered.")
+    try:
+        url = get_url(request_type, lat, lng, park_id)
+        response = session.get(url, timeout=60)
+        response.raise_for_status()
+    except (ValueError, requests.HTTPError) as error:
+        print(f"Error: {error}")
+        return
+    print(response.text)
 
-    result = subprocess.run(
-        ["http", url, f"Username:{USERNAME}", f"Token:{token}"],
-        capture_output=True, text=True, check=True
-    )
 
-    print(result.stdout)
+if __name__ == "__main__":
+    # One session keeps the connection alive across queries.
+    with requests.Session() as session:
+        session.headers.update({"Username": USERNAME, "Token": token})
+        try:
+            while True:
+                fetch(session)
+        except (EOFError, KeyboardInterrupt):
+            # Ctrl-D or Ctrl-C ends the session.
+            print()
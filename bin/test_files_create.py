@@ -4,11 +4,27 @@ data/20230613 directory has two GFS files and two GEFS files for testing.
 This script will load these files, duplicate them, and store duplicated files
 in 30770617/12/gfs and 30770617/12/gefs, respectively.
 """
+import concurrent.futures
 import os
 import shutil
 from dataserver.process import process_gfs_file, process_gefs_file
 
 
+def link_or_copy(src, dst):
+    """Hard link dst to src, or copy it if a link cannot be created.
+
+    Test files are never modified in place, so sharing an inode is safe.
+    An existing dst is removed first: it may already be a link to src, in
+    which case copying onto it would truncate src.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
 def copy_files_to_tmp():
     """Copy the GFS and GEFS files to tmp/.
 
@@ -32,23 +48,33 @@ def copy_files_to_tmp():
         ("data/20230613/gefs.chem.t12z.a2d_0p25.f009.grib2",
          "tmp/gefs/gefs.f009")
     ]
-    for (src, dst) in gfs_info:
-        shutil.copy(src, dst)
-    for (src, dst) in gefs_info:
-        shutil.copy(src, dst)
+    for (src, dst) in gfs_info + gefs_info:
+        shutil.copyfile(src, dst)
 
 
 def process_files():
-    """Process files by calling functions in dataserver.process module."""
-    def process_directory(directory_root, function):
+    """Process files by calling functions in dataserver.process module.
+
+    GRIB decoding is CPU bound, so files are processed in parallel by one
+    process pool shared by both directories.
+    """
+    def process_directory(executor, directory_root, function):
         """Process a directory with input `function`."""
-        filenames = os.listdir(directory_root)
-        for each_file in filenames:
-            full_path = f"{directory_root}/{each_file}"
+        with os.scandir(directory_root) as entries:
+            paths = [entry.path for entry in entries]
+        for full_path in paths:
             print(f"Processing file {full_path}.")
-            function(full_path)
-    process_directory("tmp/gfs", process_gfs_file)
-    process_directory("tmp/gefs", process_gefs_file)
+        return executor.map(function, paths)
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=os.cpu_count()) as executor:
+        results = [
+            process_directory(executor, "tmp/gfs", process_gfs_file),
+            process_directory(executor, "tmp/gefs", process_gefs_file)
+        ]
+        # Consume results so that exceptions in workers are raised here.
+        for result in results:
+            list(result)
 
 
 def duplicate_files():
@@ -77,31 +103,21 @@ def duplicate_files():
     for hour in range(72):
         file_suffix = f"f{hour:03d}.npy"
         if hour % 2 == 0:
-            shutil.copy(
-                cloud_even_source,
-                f"{gfs_destination}/cloud.{file_suffix}"
-            )
-            shutil.copy(
-                humidity_even_source,
-                f"{gfs_destination}/humidity.{file_suffix}"
-            )
-            shutil.copy(
-                aerosol_even_source,
-                f"{gefs_destination}/aerosol.{file_suffix}"
+            sources = (
+                cloud_even_source, humidity_even_source, aerosol_even_source
             )
         else:
-            shutil.copy(
-                cloud_odd_source,
-                f"{gfs_destination}/cloud.{file_suffix}"
-            )
-            shutil.copy(
-                humidity_odd_source,
-                f"{gfs_destination}/humidity.{file_suffix}"
-            )
-            shutil.copy(
-                aerosol_odd_source,
-                f"{gefs_destination}/aerosol.{file_suffix}"
+            sources = (
+                cloud_odd_source, humidity_odd_source, aerosol_odd_source
             )
+        cloud_source, humidity_source, aerosol_source = sources
+        link_or_copy(cloud_source, f"{gfs_destination}/cloud.{file_suffix}")
+        link_or_copy(
+            humidity_source, f"{gfs_destination}/humidity.{file_suffix}"
+        )
+        link_or_copy(
+            aerosol_source, f"{gefs_destination}/aerosol.{file_suffix}"
+        )
 
 
 def write_complete_flag():
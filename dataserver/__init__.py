@@ -8,8 +8,18 @@ CORS(app)
 app.config.from_object("dataserver.config")
 import dataserver.model  # noqa: E402  pylint: disable=wrong-import-position
 import dataserver.api  # noqa: E402  pylint: disable=wrong-import-position
-import dataserver.controllers  # noqa: E402  pylint: disable=wrong-import-position
 import dataserver.views  # noqa: E402  pylint: disable=wrong-import-position
 
 LATS = np.load("data/0p25_lats.npy")
 LNGS = np.load("data/0p25_lngs.npy")
+
+
+def create_app():
+    """Return the app after loading the lookup data shared by all requests.
+
+    This is the entry point of the web server, e.g.
+    FLASK_APP="dataserver:create_app()". Other users of the package, such as
+    the download scripts, only import it and skip the warm-up.
+    """
+    dataserver.api.warmup()
+    return app
@@ -1,4 +1,5 @@
 """Data server api package init."""
 from dataserver.api.forecasts import get_transparency_forecast
 from dataserver.api.history import get_historical_transparency
-from dataserver.api.requests import get_park_name
+from dataserver.api.requests import get_park_name, get_park_names
+from dataserver.api.health import get_health, warmup
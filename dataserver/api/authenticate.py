@@ -1,29 +1,49 @@
 """Authenticate an API user."""
+import hmac
+import time
 import flask
 from dataserver.model import get_users_db
 
 
-def authenticate(request_object):
-    """Return 403 if input token is incorrect."""
-    username = request_object.headers.get("Username")
-    input_token = request_object.headers.get("Token")
-    if username is None or input_token is None:
-        flask.abort(400, description="Check username and input token.")
+# Tokens rarely change, so they are cached in memory to skip a database round
+# trip on every API call. {username: (time fetched, token)}
+_TOKEN_CACHE = {}
+_TOKEN_TTL = 60
+
+
+def _lookup_token(username):
+    """Return the stored token of `username`, cached for _TOKEN_TTL seconds."""
+    cached = _TOKEN_CACHE.get(username)
+    if cached is not None and time.monotonic() - cached[0] < _TOKEN_TTL:
+        return cached[1]
 
-    # Check if token is correct.
     connection = get_users_db()
     cursor = connection.cursor()
     cursor.execute(
         "SELECT token FROM users WHERE username = %s", (username, )
     )
-    results = cursor.fetchall()
+    # username is unique in users, so there is at most one row.
+    result = cursor.fetchone()
 
-    if len(results) != 1:
+    if result is None:
         flask.abort(400, description="Non-unique tokens found.")
 
-    stored_token = results[0][0]
+    stored_token = result[0]
+    _TOKEN_CACHE[username] = (time.monotonic(), stored_token)
+    return stored_token
+
+
+def authenticate(request_object):
+    """Return 403 if input token is incorrect."""
+    username = request_object.headers.get("Username")
+    input_token = request_object.headers.get("Token")
+    if username is None or input_token is None:
+        flask.abort(400, description="Check username and input token.")
+
+    # Check if token is correct.
+    stored_token = _lookup_token(username)
 
-    if input_token != stored_token:
+    if not hmac.compare_digest(input_token.encode(), stored_token.encode()):
         flask.abort(403)
 
     # Authentication complete.
@@ -1,6 +1,7 @@
 """API endpoint for forecasts data (cloud, humidity, and aerosol)."""
+import functools
 import os
-from datetime import datetime, timedelta
+from datetime import timedelta
 import flask
 from flask import request
 import numpy as np
@@ -12,15 +13,26 @@ from dataserver.logger import logger
 from dataserver.api.utilities import get_directory, get_timezone, \
     get_forecast_type_and_hour, get_coordinates, get_lat_lng_idx, round_time, \
     get_light_pollution_score, get_milky_way_max_angle, \
-    compute_hour_score, compute_final_score, get_object_activity
-from dataserver.model import get_cloud_humidity_index, get_aerosol_index
+    compute_night_scores, compute_final_score, \
+    create_observer, get_pytz_timezone, get_all_object_activity, \
+    parse_timestamp, format_date, dumps_json
+from dataserver.model import get_cloud_humidity_indices, \
+    get_aerosol_indices, get_conversion_table
+from dataserver.process import FORECAST_TYPES
 
 
 HOURS_OF_PREDICTION = 72
 # Get forecasts for 5 days and keep results for 4 days.
 MOON_FORECAST_DAYS = 5
 MOON_RESULT_DAYS = 4
-CONVERSION_TABLE_PATH = "data/sky_transparency_table.npy"
+# Static lookup tables are loaded once instead of on every request.
+CONVERSION_TABLE = get_conversion_table()
+# 1-D view of the conversion table for `np.take` lookups.
+FLAT_CONVERSION_TABLE = CONVERSION_TABLE.reshape(-1)
+_, HUMIDITY_LEVELS, AEROSOL_LEVELS = CONVERSION_TABLE.shape
+# Scores are small integers stored as floats, so they are converted once.
+SCORE_TABLE = np.load(SCORE_TABLE_PATH).astype(np.int8)
+SCORE_TABLE.setflags(write=False)
 
 
 @dataserver.app.route("/api/transparency-forecast/")
@@ -32,9 +44,35 @@ def get_transparency_forecast():
     """
     authenticate(request)
 
+    lat, lng = get_coordinates(request)
+    park_id = request.args.get("park_id")
+    # If the function is running for testing, choose a future(debug) date.
+    # Otherwise use current date.
+    current_date_str = "30770617" if request.args.get("test") is not None \
+        else None
+
+    # Responses only change when a new forecast cycle is processed, so the
+    # timestamp of the latest data is part of the cache key.
+    _, timestamp = get_directory("gfs", current_date_str)
+    response_body = get_forecast_response(
+        lat, lng, park_id, current_date_str, timestamp
+    )
+
+    return flask.Response(response_body, mimetype="application/json"), 200
+
+
+@functools.lru_cache(maxsize=2048)
+def get_forecast_response(lat, lng, park_id, current_date_str, timestamp):
+    """Return the serialized forecast JSON of a location, cached.
+
+    `timestamp` is not used directly. It is the timestamp of the latest
+    forecast data, which makes cached responses expire with new data.
+    """
+    del timestamp  # only part of the cache key
+
     # Get the three aspects of transparency.
-    cloud_humidity_dict = get_forecasts(request, "gfs")
-    aerosol_dict = get_forecasts(request, "gefs")
+    cloud_humidity_dict = get_forecasts(lat, lng, "gfs", current_date_str)
+    aerosol_dict = get_forecasts(lat, lng, "gefs", current_date_str)
 
     # Store the existing three aspects into context.
     context = {}
@@ -53,28 +91,23 @@ def get_transparency_forecast():
     context["lat"] = aerosol_dict["lat"]
     context["lng"] = aerosol_dict["lng"]
 
-    # Compute transparency for each hour.
-    context["transparency"] = {}
-    conversion_table = np.load(CONVERSION_TABLE_PATH)
-    for each_hour in range(HOURS_OF_PREDICTION):
-        cloud = context["cloud"][each_hour]
-        humidity = context["humidity"][each_hour]
-        aerosol = context["aerosol"][each_hour]
-
-        # Get transparency score.
-        cloud_index = get_cloud_humidity_index(cloud)
-        humidity_index = get_cloud_humidity_index(humidity)
-        aerosol_index = get_aerosol_index(aerosol)
-        transparency_score = \
-            conversion_table[cloud_index][humidity_index][aerosol_index]
-        context["transparency"][each_hour] = int(transparency_score)
+    # Compute transparency for all hours with a single table lookup.
+    cloud_indices = get_cloud_humidity_indices(context["cloud"])
+    humidity_indices = get_cloud_humidity_indices(context["humidity"])
+    aerosol_indices = get_aerosol_indices(context["aerosol"])
+    flat_indices = (cloud_indices * HUMIDITY_LEVELS + humidity_indices) \
+        * AEROSOL_LEVELS + aerosol_indices
+    transparency_scores = np.take(
+        FLAT_CONVERSION_TABLE, flat_indices
+    ).astype(int)
+    context["transparency"] = transparency_scores
 
-    context = prettify_context_by_date(context, request)
+    context = prettify_context_by_date(context, park_id)
 
-    return flask.jsonify(**context), 200
+    return dumps_json(context)
 
 
-def prettify_context_by_date(context, request_object):
+def prettify_context_by_date(context, park_id):
     """Split data in context by date.
 
     Raw data in `context` are forecasts for the continuous future 72 hours.
@@ -82,27 +115,24 @@ def prettify_context_by_date(context, request_object):
     """
     # Find local time of data update.
     local_timezone = get_timezone(context["lat"], context["lng"])
-    utc_date_time = datetime.strptime(context["timestamp"], "%Y%m%d%H")
-    utc_date_time = utc_date_time.replace(tzinfo=pytz.UTC)
-    local_time = utc_date_time.astimezone(pytz.timezone(local_timezone))
-
-    prettified_context = {}
-    prettified_context["data"] = {}
-
+    timezone = get_pytz_timezone(local_timezone)
+    local_time = parse_timestamp(context["timestamp"]).replace(
+        tzinfo=pytz.UTC
+    ).astimezone(timezone)
+
+    # Convert arrays to lists of Python numbers for JSON rendering.
+    series = {
+        key: context[key].tolist()
+        for key in ("transparency", "cloud", "humidity", "aerosol")
+    }
+    prettified_context = {"data": {}}
     for each_hour in range(HOURS_OF_PREDICTION):
         current_date_time = local_time + timedelta(hours=each_hour)
-        current_day_str = current_date_time.strftime("%Y/%m/%d")
-        # Add date to dict if it does not exist.
-        if current_day_str not in prettified_context["data"]:
-            prettified_context["data"][current_day_str] = {}
-
-        # Add data of current hour to dict under current date.
-        current_hour_str = current_date_time.strftime("%H")  # 0 t0 23
-        prettified_context["data"][current_day_str][current_hour_str] = {
-            "transparency": context["transparency"][each_hour],
-            "cloud": context["cloud"][each_hour],
-            "humidity": context["humidity"][each_hour],
-            "aerosol": context["aerosol"][each_hour]
+        # Add data of current hour under its date and hour (00 to 23).
+        prettified_context["data"].setdefault(
+            format_date(current_date_time), {}
+        )[f"{current_date_time.hour:02d}"] = {
+            key: values[each_hour] for key, values in series.items()
         }
 
     prettified_context["timestamp"] = context["timestamp"]
@@ -110,56 +140,61 @@ def prettify_context_by_date(context, request_object):
     prettified_context["lat"] = context["lat"]
     prettified_context["lng"] = context["lng"]
 
-    get_dark_hours(prettified_context)
-    get_moon_activity(prettified_context)
-    get_milky_way_activity(prettified_context)
-    compute_score_forecast(prettified_context, request_object)
+    # One observer and timezone are shared by all astronomical objects.
+    observer = create_observer(context["lat"], context["lng"])
+    # Dates are added in order, so the first date is the earliest.
+    dark_hours, moon_free_intervals = get_all_activity(
+        prettified_context, observer, timezone, format_date(local_time)
+    )
+    compute_score_forecast(
+        prettified_context, park_id, dark_hours, moon_free_intervals
+    )
 
     return prettified_context
 
 
-def get_forecasts(request_object, data_type):
+def get_forecasts(lat, lng, data_type, current_date_str=None):
     """Get forecast data for coordinate and store them in context.
 
     Parameters:
-    request_object - flask.request object specific to a url.
+    lat, lng - coordinates from `get_coordinates`.
     data_type - gfs (cloud and humidity) or gefs (aerosol).
+    current_date_str - YYYYMMDD date to search data from, see
+        `get_directory`. Current date is used if it is None.
 
     Return:
     A dictionary context for JSON rendering.
     """
-    lat, lng = get_coordinates(request_object)
     lat_idx, lng_idx = get_lat_lng_idx(lat, lng)
     context = {}
     context["lat"] = lat
     context["lng"] = lng
-    if data_type == "gfs":
-        context["cloud"], context["humidity"] = {}, {}
-    elif data_type == "gefs":
-        context["aerosol"] = {}
-    data_directory = "/"
-
-    # If the function is running for testing, choose a future(debug) date.
-    if request_object.args.get("test") is not None:
-        data_directory, timestamp = get_directory(
-            data_type, "30770617"
+    if data_type not in FORECAST_TYPES:
+        raise ValueError(
+            f"Invalid data_type: {data_type}. Expected 'gfs' or 'gefs'"
         )
-    # Otherwise use current date.
-    else:
-        data_directory, timestamp = get_directory(data_type)
-
-    all_filenames = os.listdir(data_directory)
-    for filename in all_filenames:
-        data = np.load(f"{data_directory}/{filename}")
-        forecast_type, forecast_hour = get_forecast_type_and_hour(filename)
-        context[forecast_type][forecast_hour] = data[lat_idx][lng_idx]
+    # Each forecast is an array indexed by forecast hour.
+    for forecast_type in FORECAST_TYPES[data_type][0]:
+        context[forecast_type] = np.full(HOURS_OF_PREDICTION, np.nan)
+    data_directory, timestamp = get_directory(data_type, current_date_str)
+
+    if not read_stacked_forecasts(
+            context, data_directory, data_type, (lat_idx, lng_idx)):
+        # Data that are not stacked have one file per forecast hour.
+        for filename in os.listdir(data_directory):
+            # Memory-map the grid so that only the page holding the target
+            # point is read from disk.
+            data = np.load(f"{data_directory}/{filename}", mmap_mode="r")
+            forecast_type, forecast_hour = \
+                get_forecast_type_and_hour(filename)
+            context[forecast_type][forecast_hour] = data[lat_idx, lng_idx]
 
     # Special case for gefs: aerosol data update every three hours instead
     # of every hour, so we 'fill in the gaps' with most recent available data.
     if data_type == "gefs":
-        for each_hour in range(72):
-            context["aerosol"][each_hour] = \
-                context["aerosol"][(each_hour//3) * 3]
+        context["aerosol"] = np.repeat(
+            context["aerosol"][::3], 3
+        )[:HOURS_OF_PREDICTION]
 
     context["timestamp"] = timestamp
     context["lat"] = lat
@@ -167,29 +202,49 @@ def get_forecasts(request_object, data_type):
     return context
 
 
-def get_dark_hours(context):
-    """Add dark hours and moon activity to context."""
-    context["dark_hours"] = []
-    get_object_activity(context, "sun")
+def read_stacked_forecasts(context, data_directory, data_type, grid_idx):
+    """Read forecasts of a grid point from stacked files into context.
 
+    Hourly forecasts are stacked into (hour, lat, lng) arrays when processed,
+    so one read per forecast type gets all hours.
 
-def get_moon_activity(context):
-    """Add moon set and rise times to context."""
-    context["moon_activity"] = []
-    get_object_activity(context, "moon")
-
+    Parameters:
+    grid_idx - (lat_idx, lng_idx) of the grid point.
 
-def get_milky_way_activity(context):
-    """Add Milky Way activity into context."""
+    Return:
+    False if the forecasts are not stacked yet, True otherwise.
+    """
+    forecast_types, hour_step = FORECAST_TYPES[data_type]
+    stacked_paths = [
+        f"{data_directory}/{forecast_type}.npy"
+        for forecast_type in forecast_types
+    ]
+    if not all(os.path.exists(path) for path in stacked_paths):
+        return False
+    for forecast_type, path in zip(forecast_types, stacked_paths):
+        data = np.load(path, mmap_mode="r")
+        context[forecast_type][::hour_step] = data[(slice(None), *grid_idx)]
+    return True
+
+
+def get_all_activity(context, observer, timezone, start_date):
+    """Add dark hours, moon activity, and Milky Way activity into context.
+
+    Sun, moon, and Milky Way rise and set times are found in one sweep over
+    dates starting at `start_date`, and the Milky Way center max angle is
+    added as well. Return dark hours and moon-free intervals for scoring,
+    see `get_all_object_activity`.
+    """
+    context["dark_hours"] = []
+    context["moon_activity"] = []
     context["milky_way"] = {}
-    get_milky_way_max_angle(
-        context["milky_way"], context["lat"], context["lng"]
-    )
+    get_milky_way_max_angle(context["milky_way"], observer)
     context["milky_way"]["activity"] = []
-    get_object_activity(context, "milky_way")
+    return get_all_object_activity(context, observer, timezone, start_date)
 
 
-def compute_score_forecast(context, request_object):
+def compute_score_forecast(context, park_id, dark_hours,
+                           moon_free_intervals):
     """Compute stargazing score for forecast page.
 
     If `park_id` is not None, use it to determine light pollution score.
@@ -197,38 +252,31 @@ def compute_score_forecast(context, request_object):
     At this step, `context` already contains `lat` and `lng`, which are
     determined earlier by `get_coordinates` function. If they were not
     provided, an exception would have been thrown earlier.
+
+    `dark_hours` and `moon_free_intervals` are returned by
+    `get_all_activity`: lists of (sunset, sunrise) naive local datetimes and
+    of (moonset, moonrise) UTC datetimes.
     """
-    park_id = request_object.args.get("park_id")
     if park_id is not None:
         light_pollution_score = get_light_pollution_score(park_id, None)
     else:
         light_pollution_score = get_light_pollution_score(
             None, (context["lat"], context["lng"])
         )
-    score_table = np.load(SCORE_TABLE_PATH)
-    scores = []
-    for dark_hour_object in context["dark_hours"]:
-        sunset_dt = datetime.strptime(
-            dark_hour_object["set"], "%Y/%m/%d %H:%M"
-        )
-        sunrise_dt = datetime.strptime(
-            dark_hour_object["rise"], "%Y/%m/%d %H:%M"
-        )
+    # Dark hours of all nights are scored in one pass.
+    hours_dt = []
+    for sunset_dt, sunrise_dt in dark_hours:
         # Round up sunset hour and round down sunrise hour.
         sunset_dt = round_time(sunset_dt, "up")
         sunrise_dt = round_time(sunrise_dt, "down")
-        hour_dt = sunset_dt
-        while hour_dt != sunrise_dt:
-            try:
-                scores.append(
-                    compute_hour_score(context, hour_dt,
-                                       light_pollution_score, score_table)
-                )
-            except ValueError as error:
-                logger.error(
-                    "Ignored error: %s", error
-                )
-            hour_dt += timedelta(hours=1)
+        num_hours = (sunrise_dt - sunset_dt) // timedelta(hours=1)
+        hours_dt += [
+            sunset_dt + timedelta(hours=hour) for hour in range(num_hours)
+        ]
+    scores = compute_night_scores(
+        context, hours_dt, light_pollution_score, SCORE_TABLE,
+        moon_free_intervals
+    )
     try:
         context["score"] = compute_final_score(scores)
     except ValueError as error:
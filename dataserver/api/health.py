@@ -0,0 +1,39 @@
+"""Process warm-up and health check."""
+import flask
+import dataserver
+from dataserver.logger import logger
+from dataserver.api.history import get_history_array
+from dataserver.api.utilities import get_timezone_finder
+
+
+HISTORY_DATA_TYPES = ("transparency", "cloud", "humidity", "aerosol")
+# Whether `warmup` has completed in this process.
+WARMUP_STATUS = {"complete": False}
+
+
+def warmup():
+    """Load lookup data shared by all requests before the first request.
+
+    Lookup tables and the Sagittarius body are loaded when modules are
+    imported. This loads the rest: timezone polygons and history arrays.
+    It is called by `dataserver.create_app` when the web server starts. Start
+    the server before workers fork (e.g. gunicorn --preload) so that they
+    share the loaded pages.
+    """
+    get_timezone_finder()
+    try:
+        for month in range(1, 13):
+            for data_type in HISTORY_DATA_TYPES:
+                get_history_array(month, data_type)
+    except FileNotFoundError as error:
+        # History data are generated offline and may not exist yet.
+        logger.warning("History data not loaded: %s", error)
+    WARMUP_STATUS["complete"] = True
+    logger.info("Warm-up complete.")
+
+
+@dataserver.app.route("/api/health/")
+def get_health():
+    """Return server status without touching databases or data files."""
+    context = {"status": "ok", "warmup": WARMUP_STATUS["complete"]}
+    return flask.jsonify(**context), 200
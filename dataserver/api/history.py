@@ -1,4 +1,6 @@
 """API endpoint for retrieving average/historical transparency data."""
+import bisect
+import functools
 import json
 from datetime import datetime, timedelta
 import flask
@@ -8,10 +10,21 @@ import pytz
 import dataserver
 from dataserver.api.authenticate import authenticate
 from dataserver.api.utilities import get_lat_lng_idx, get_coordinates, \
-    get_timezone, get_milky_way_max_angle, get_bortle_class
+    get_timezone, get_milky_way_max_angle, get_bortle_class, \
+    create_observer, get_pytz_timezone, SAGITTARIUS, parse_date, dumps_json
+from dataserver.config import METEOR_SHOWER_TABLE_PATH
 from dataserver.logger import logger
 
 
+# Meteor showers are updated once a year and read by every request.
+with open(METEOR_SHOWER_TABLE_PATH, encoding="utf-8") as meteor_file:
+    METEOR_SHOWER_TABLE = json.load(meteor_file)
+# yyyy/mm/dd strings sort chronologically.
+METEOR_SHOWER_MAX_DATES = [
+    meteor_shower["max_date"] for meteor_shower in METEOR_SHOWER_TABLE["data"]
+]
+
+
 @dataserver.app.route("/api/historical-transparency/")
 def get_historical_transparency():
     """Return the historical/average transparency data for a given location.
@@ -25,9 +38,6 @@ def get_historical_transparency():
 
     lat, lng = get_coordinates(flask.request)
     lat_idx, lng_idx = get_lat_lng_idx(lat, lng)  # this function checks errors
-    history_data_path = str(
-        dataserver.app.config["SERVER_ROOT"]/"history_data"
-    )
     context = {}
     context["lat"] = lat
     context["lng"] = lng
@@ -36,15 +46,14 @@ def get_historical_transparency():
     context["transparency"], context["cloud"] = {}, {}
     context["humidity"], context["aerosol"] = {}, {}
     for month in range(1, 13):
-        transparency = np.load(f"{history_data_path}/{month}/transparency.npy")
-        cloud = np.load(f"{history_data_path}/{month}/cloud.npy")
-        humidity = np.load(f"{history_data_path}/{month}/humidity.npy")
-        aerosol = np.load(f"{history_data_path}/{month}/aerosol.npy")
-
-        context["transparency"][month] = int(transparency[lat_idx][lng_idx])
-        context["cloud"][month] = cloud[lat_idx][lng_idx]
-        context["humidity"][month] = humidity[lat_idx][lng_idx]
-        context["aerosol"][month] = aerosol[lat_idx][lng_idx]
+        context["transparency"][month] = \
+            int(get_history_array(month, "transparency")[lat_idx, lng_idx])
+        context["cloud"][month] = \
+            get_history_array(month, "cloud")[lat_idx, lng_idx]
+        context["humidity"][month] = \
+            get_history_array(month, "humidity")[lat_idx, lng_idx]
+        context["aerosol"][month] = \
+            get_history_array(month, "aerosol")[lat_idx, lng_idx]
 
     context["timezone"] = get_timezone(lat, lng)
     context["year"] = str(datetime.now().year)
@@ -54,7 +63,27 @@ def get_historical_transparency():
     get_light_pollution(context, flask.request)
     get_next_meteor_shower(context)
 
-    return flask.jsonify(**context), 200
+    return flask.Response(
+        dumps_json(context), mimetype="application/json"
+    ), 200
+
+
+@functools.lru_cache(maxsize=None)
+def get_history_array(month, data_type):
+    """Return the memory-mapped history array of `data_type` in `month`.
+
+    History data are generated offline and never change while the server is
+    running, so each of the 48 files is opened once and shared by all
+    requests. Only the pages that requests touch are read into memory.
+
+    Parameters:
+    month - 1 to 12.
+    data_type - transparency, cloud, humidity, or aerosol.
+    """
+    history_data_path = dataserver.app.config["SERVER_ROOT"]/"history_data"
+    return np.load(
+        f"{history_data_path}/{month}/{data_type}.npy", mmap_mode="r"
+    )
 
 
 def get_milky_way_season(context):
@@ -66,21 +95,17 @@ def get_milky_way_season(context):
     midnight (12:00 AM).
     """
     context["milky_way_season"] = {}
-    get_milky_way_max_angle(
-        context["milky_way_season"], context["lat"], context["lng"]
-    )
+    observer = create_observer(context["lat"], context["lng"])
+    get_milky_way_max_angle(context["milky_way_season"], observer)
 
-    observer = ephem.Observer()
-    observer.lat = str(context["lat"])
-    observer.lon = str(context["lng"])
-    sagittarius = ephem.readdb("Sgr,f|C|F7,17:58:03.470,-26:06:04.6,1.00,2000")
+    sagittarius = SAGITTARIUS.copy()
 
     # Determine start date: {current_year}/01/01.
     current_year = context["year"]
     start_date = f"{current_year}/01/01"
-    start_date = datetime.strptime(start_date, "%Y/%m/%d")
-    end_date = datetime.strptime(f"{current_year}/12/31", "%Y/%m/%d")
-    timezone = pytz.timezone(context["timezone"])
+    start_date = parse_date(start_date)
+    end_date = parse_date(f"{current_year}/12/31")
+    timezone = get_pytz_timezone(context["timezone"])
 
     start_is_found = False
     date = start_date
@@ -130,16 +155,17 @@ def get_milky_way_season(context):
 def get_new_moon_dates(context):
     """Get all new moon dates in current year."""
     current_year = int(context["year"])
-    timezone = pytz.timezone(context["timezone"])
-    start_date = datetime.strptime(
-        f"{current_year}/01/01", "%Y/%m/%d"
-    )
+    timezone = get_pytz_timezone(context["timezone"])
+    start_date = datetime(current_year, 1, 1)
 
     # Earliest new moon date of ephem format.
     new_moon_date_ep = ephem.previous_new_moon(start_date)
 
+    # Stop at the first new moon of next year, compared in ephem format.
+    end_date_ep = ephem.Date(f"{current_year + 1}/01/01")
+
     all_dates = []
-    while new_moon_date_ep.datetime().year < current_year + 1:
+    while new_moon_date_ep < end_date_ep:
         # Convert it to datetime object and add UTC timezone info.
         new_moon_date_utc = new_moon_date_ep.datetime().replace(
             tzinfo=pytz.UTC
@@ -181,17 +207,12 @@ def get_next_meteor_shower(context):
     Meteor showers in data/meteor_shower_table.json are already sorted in
     ascending order by `max_date`.
     """
-    table_path = "data/meteor_shower_table.json"
-    with open(table_path, encoding="utf-8") as file:
-        table = json.load(file)
-
     # Find the meteor shower whose `max_date` is no less than (>=) `today`.
     today = datetime.now().strftime("%Y/%m/%d")
-    for meteor_shower in table["data"]:
-        max_date = meteor_shower["max_date"]
-        if max_date >= today:
-            context["next_meteor_shower"] = meteor_shower
-            return
+    index = bisect.bisect_left(METEOR_SHOWER_MAX_DATES, today)
+    if index < len(METEOR_SHOWER_MAX_DATES):
+        context["next_meteor_shower"] = METEOR_SHOWER_TABLE["data"][index]
+        return
 
     # NOTE: the code should never reach here.
     logger.error("Cannot find next meteor shower for %s.", today)
@@ -2,8 +2,11 @@
 import flask
 from flask import request
 import dataserver
-from dataserver.logger import logger
 from dataserver.api.authenticate import authenticate
+from dataserver.api.utilities import get_park_row, get_park_rows
+
+
+PARK_NAME_MAX_AGE = 86400  # seconds
 
 
 @dataserver.app.route("/api/get-park-name/")
@@ -14,26 +17,42 @@ def get_park_name():
     park_id = request.args.get("park_id")
     if park_id is None:
         raise ValueError("park_id cannot be None.")
-    connection = dataserver.model.get_parks_db()
-    cursor = connection.cursor()
-    cursor.execute(
-        "SELECT * FROM parks WHERE id = %s", (park_id, )
-    )
-    data = cursor.fetchall()
-    if len(data) == 0:
+    park_row = get_park_row(park_id)
+    if park_row is None:
         raise ValueError(f"No matches for park_id {park_id} in the database.")
-    # Shouldn't really happen.
-    if len(data) > 1:
-        logger.warning(
-            "In details.py more than 1 match found in parks database."
-        )
-
-    # (id, lat, lng, park_name, admin_name, country, light_pollution)
-    park_info = data[0]
-    park_name = park_info[3]
-    admin_name = park_info[4]
-    country = park_info[5]
-
-    fullname = f"{park_name}, {admin_name}, {country}"
+
+    fullname = f"{park_row.name}, {park_row.admin}, {park_row.country}"
     context = {"fullname": fullname}
+
+    # Park names never change, so clients may reuse the response and
+    # revalidate it with the ETag. It is private since the endpoint requires
+    # authentication, which a shared cache would bypass.
+    response = flask.jsonify(**context)
+    response.cache_control.private = True
+    response.cache_control.max_age = PARK_NAME_MAX_AGE
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@dataserver.app.route("/api/get-park-names/")
+def get_park_names():
+    """Return park fullnames based on parameter `park_ids`.
+
+    `park_ids` is a comma separated list of ids, e.g. 1,2,3. All parks are
+    fetched with one query. Ids with no matches are left out of the result.
+    """
+    authenticate(flask.request)
+
+    park_ids = request.args.get("park_ids")
+    if park_ids is None:
+        raise ValueError("park_ids cannot be None.")
+    try:
+        park_ids = [int(park_id) for park_id in park_ids.split(",")]
+    except ValueError as error:
+        raise ValueError(f"Invalid park_ids {park_ids}.") from error
+
+    context = {"fullnames": {
+        park_id: f"{park_row.name}, {park_row.admin}, {park_row.country}"
+        for park_id, park_row in get_park_rows(park_ids).items()
+    }}
     return flask.jsonify(**context), 200
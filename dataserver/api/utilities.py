@@ -1,8 +1,15 @@
 """Utility functions for dataserver/api."""
+import collections
+import concurrent.futures
+import functools
 import os
 import math
+import threading
+import time
 from datetime import datetime, timedelta
 import ephem
+import numpy as np
+import orjson
 import pytz
 from timezonefinder import TimezoneFinder
 import dataserver
@@ -11,6 +18,21 @@ from preprocessing.light_pollution.bortle import get_bortle
 
 
 DAYS_OF_ACTIVITY = 4
+# Latest processed runs. {current_date_str: (time fetched, (path, timestamp))}
+DIRECTORY_CACHE = {}
+DIRECTORY_TTL = 60
+# Sagittarius, constellation at Milky Way center. The catalog entry is parsed
+# once; ephem bodies keep computed positions, so each use takes a copy.
+SAGITTARIUS = ephem.readdb("Sgr,f|C|F7,17:58:03.470,-26:06:04.6,1.00,2000")
+# Light pollution score indexed by Bortle class 1 to 9.
+LIGHT_POLLUTION_SCORES = (None, 0, 1, 1, 1, 2, 3, 3, 3, 3)
+# A row in the parks table.
+Park = collections.namedtuple(
+    "Park", "id lat lng name admin country light_pollution"
+)
+# Parks queries in flight. {park_id: Future of the Park row}
+PARK_ROW_QUERIES = {}
+PARK_ROW_QUERIES_LOCK = threading.Lock()
 
 
 def get_directory(data_type, current_date_str=None):
@@ -28,23 +50,79 @@ def get_directory(data_type, current_date_str=None):
     # string type
     if current_date_str is None:
         current_date_str = datetime.now().strftime("%Y%m%d")
+
+    # New data are processed every 6 hours, so the latest run is cached for
+    # a short while instead of being searched for on every request.
+    cached = DIRECTORY_CACHE.get(current_date_str)
+    if cached is None or time.monotonic() - cached[0] >= DIRECTORY_TTL:
+        cached = (time.monotonic(), find_latest_run(current_date_str))
+        DIRECTORY_CACHE[current_date_str] = cached
+    run_path, timestamp = cached[1]
+    return (f"{run_path}/{data_type}", timestamp)
+
+
+def find_latest_run(current_date_str):
+    """Return (run_path, timestamp) of the most recent processed run.
+
+    E.g. ("data/20230711/00", "2023071100").
+    """
     data_times = ["18", "12", "06", "00"]
     data_retention_time = 3
     completion_flag = "complete.flag"
+    # datetime type
+    current_date_dt = parse_timestamp(f"{current_date_str}00")
     # Find the most recent data starting from present up to 3 days.
     for day in range(data_retention_time):
-        # datetime type
-        current_date_dt = datetime.strptime(current_date_str, "%Y%m%d")
         date_dt = current_date_dt - timedelta(days=day)
         date_str = date_dt.strftime("%Y%m%d")
         for each_time in data_times:
+            # The flag is only written into a run directory once processing
+            # completes, so it alone tells if the run is ready.
             dir_path = f"data/{date_str}/{each_time}"
-            if os.path.exists(dir_path) and \
-               os.path.exists(f"{dir_path}/{completion_flag}"):
-                return (f"{dir_path}/{data_type}", f"{date_str}{each_time}")
+            if os.path.exists(f"{dir_path}/{completion_flag}"):
+                return (dir_path, f"{date_str}{each_time}")
     raise FileNotFoundError("Cannot find processed NOAA datasets.")
 
 
+def parse_date(date_str):
+    """Parse `yyyy/mm/dd` into a naive datetime.
+
+    Timestamps in this module have fixed formats, so slicing them is much
+    faster than `datetime.strptime`.
+    """
+    return datetime(int(date_str[:4]), int(date_str[5:7]), int(date_str[8:10]))
+
+
+def parse_date_time(date_time_str):
+    """Parse `yyyy/mm/dd HH:MM` into a naive datetime."""
+    return datetime(
+        int(date_time_str[:4]), int(date_time_str[5:7]),
+        int(date_time_str[8:10]), int(date_time_str[11:13]),
+        int(date_time_str[14:16])
+    )
+
+
+def parse_timestamp(timestamp):
+    """Parse `YYYYMMDDHH`, e.g. 2023071100, into a naive datetime."""
+    return datetime(
+        int(timestamp[:4]), int(timestamp[4:6]), int(timestamp[6:8]),
+        int(timestamp[8:10])
+    )
+
+
+def format_date(date_time_dt):
+    """Format a datetime as `yyyy/mm/dd`, faster than `strftime`."""
+    return f"{date_time_dt.year:04d}/{date_time_dt.month:02d}/" \
+        f"{date_time_dt.day:02d}"
+
+
+def format_date_time(date_time_dt):
+    """Format a datetime as `yyyy/mm/dd HH:MM`, faster than `strftime`."""
+    return f"{date_time_dt.year:04d}/{date_time_dt.month:02d}/" \
+        f"{date_time_dt.day:02d} {date_time_dt.hour:02d}:" \
+        f"{date_time_dt.minute:02d}"
+
+
 def get_forecast_type_and_hour(filename):
     """Extract forecast type and hour from filename.
 
@@ -55,8 +133,8 @@ def get_forecast_type_and_hour(filename):
     Return:
     A tuple of forecast type and hour. E.g. cloud.f007.npy -> (cloud, 7)
     """
-    forecast_type = filename.split(".")[0]
-    forecast_hour_string = filename.split(".")[1]
+    forecast_type, _, rest = filename.partition(".")
+    forecast_hour_string = rest.partition(".")[0]
     assert len(forecast_hour_string) == 4
     forecast_hour_int = int(forecast_hour_string[1:])
     return (forecast_type, forecast_hour_int)
@@ -72,6 +150,9 @@ def get_coordinates(request_object):
     then coordinates will be determined by checking query parameters.
 
     If query parameters do not contain coordinates information, throw an error.
+
+    Coordinates are returned as strings either way, and are passed down as
+    is. Helpers that need numbers convert them behind their caches.
     """
     def read_coordinates_from_request(request_object):
         """Directly obtain coordinates from request parameters."""
@@ -87,26 +168,90 @@ def get_coordinates(request_object):
 
     park_id = request_object.args.get("park_id")
     if park_id is not None:
-        connection = dataserver.model.get_parks_db()
-        cursor = connection.cursor()
-        cursor.execute(
-            "SELECT lat, lng FROM parks WHERE id = %s", (park_id, )
-        )
-        results = cursor.fetchall()
-        if len(results) == 0:
+        park_row = get_park_row(park_id)
+        if park_row is None:
             # Case 2: park_id provided but no results in database.
             return read_coordinates_from_request(request_object)
-        if len(results) > 1:
-            logger.error(
-                "More than one set of coordinates obtained from database. "
-                "park_id: %s", park_id
-            )
         # Case 1: determine coordinates by park_id.
-        return results[0]  # already a tuple of (lat, lng)
+        return (park_row.lat, park_row.lng)
     # Case 2: no park_id provided.
     return read_coordinates_from_request(request_object)
 
 
+@functools.lru_cache(maxsize=4096)
+def get_park_row(park_id):
+    """Return the row of a park in the parks database, cached by park_id.
+
+    Every park field an API call needs is fetched by this single query, so a
+    request that supplies park_id makes at most one round trip to parks.
+
+    Return:
+    a Park, or None if there are no matches for park_id.
+
+    The parks table only changes when parks are added offline, so rows are
+    cached for the lifetime of the process. Call `get_park_row.cache_clear()`
+    after the table is updated.
+
+    The cache only helps once a lookup has completed, so concurrent requests
+    for the same uncached park_id wait on the first one's query instead of
+    issuing their own.
+    """
+    with PARK_ROW_QUERIES_LOCK:
+        future = PARK_ROW_QUERIES.get(park_id)
+        is_owner = future is None
+        if is_owner:
+            future = concurrent.futures.Future()
+            PARK_ROW_QUERIES[park_id] = future
+
+    if is_owner:
+        try:
+            future.set_result(query_park_row(park_id))
+        except Exception as error:  # pylint: disable=broad-except
+            future.set_exception(error)
+        finally:
+            with PARK_ROW_QUERIES_LOCK:
+                del PARK_ROW_QUERIES[park_id]
+    return future.result()
+
+
+def query_park_row(park_id):
+    """Query the parks database for the row of park_id."""
+    connection = dataserver.model.get_parks_db()
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT id, lat, lng, park_name, admin_name, country, light_pollution "
+        "FROM parks WHERE id = %s", (park_id, )
+    )
+    # id is the primary key of parks, so there is at most one row.
+    result = cursor.fetchone()
+    if result is None:
+        return None
+    return make_park(result)
+
+
+def get_park_rows(park_ids):
+    """Return the rows of several parks with a single query.
+
+    Return:
+    a dict {id: Park} of the parks found. Missing ids are left out.
+    """
+    connection = dataserver.model.get_parks_db()
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT id, lat, lng, park_name, admin_name, country, light_pollution "
+        "FROM parks WHERE id = ANY(%s)", (list(park_ids), )
+    )
+    return {result[0]: make_park(result) for result in cursor.fetchall()}
+
+
+def make_park(result):
+    """Convert a row of the parks table into a Park."""
+    park = Park(*result)
+    # Coordinates are DECIMAL in the database. They are converted once here
+    # into strings, the same type as coordinates in request parameters.
+    return park._replace(lat=str(park.lat), lng=str(park.lng))
+
+
 def get_lat_lng_idx(lat, lng):
     """Check the validity of input latitude and longitude.
 
@@ -114,10 +259,16 @@ def get_lat_lng_idx(lat, lng):
     """
     if lat is None or lng is None:
         raise ValueError("Latitude and longitude cannot be empty.")
+    return get_lat_lng_idx_cached(float(lat), float(lng))
+
+
+@functools.lru_cache(maxsize=4096)
+def get_lat_lng_idx_cached(lat, lng):
+    """Return (lat_idx, lng_idx) of float coordinates, cached."""
     # Error raised by get_lat_idx or get_lng_idx would be automatically
     # propagated upwards.
-    lat_idx, lng_idx = dataserver.model.get_lat_idx(float(lat)), \
-        dataserver.model.get_lng_idx(float(lng))
+    lat_idx, lng_idx = dataserver.model.get_lat_idx(lat), \
+        dataserver.model.get_lng_idx(lng)
     # Both are valid, return a tuple.
     return (lat_idx, lng_idx)
 
@@ -140,236 +291,268 @@ def get_bortle_class(park_id=None, coordinates=None):
         raise ValueError("Both park_id and coordinates are not None.")
     if park_id is not None:
         # Get Bortle class computed for the park.
-        connection = dataserver.model.get_parks_db()
-        cursor = connection.cursor()
-        cursor.execute(
-            "SELECT light_pollution from parks WHERE id = %s", (park_id, )
-        )
-        result = cursor.fetchall()
-        if len(result) == 0:
+        park_row = get_park_row(str(park_id))
+        if park_row is None:
             raise ValueError(
                 f"No light pollution data fetched for park_id {park_id}."
             )
-        if len(result) > 1:
-            logger.warning(
-                "More than one light pollution data fetched for park_id %s.",
-                park_id
-            )
-        return int(result[0][0])
+        return int(park_row.light_pollution)
 
     # The other case - find Bortle class by coordinates.
     lat, lng = coordinates  # both strings and doubles are fine
-    return get_bortle(lng, lat)
+    # Coordinates are rounded to 3 decimal places (about 100 m), finer than
+    # the 30 arc-second cells of the light pollution map, so that nearby
+    # requests share cached results.
+    return get_bortle_cached(round(float(lat), 3), round(float(lng), 3))
 
 
-def get_setting_rising_pairs(
-        start_date, result_dict, astro_object, observer, timezone
-):
-    """Obtain FOUR setting and rising pairs.
+@functools.lru_cache(maxsize=8192)
+def get_bortle_cached(lat, lng):
+    """Return Bortle class at rounded location (lat, lng), cached.
 
-    A setting and rising pair records the setting and rising times of an
-    astronomical object, e.g. Sun, on a given date. For example:
-    {
-      "sunset": xxxx, "sunrise": xxxx
-    }
+    The light pollution map is a static raster, so each location only needs
+    one spatial query.
+    """
+    return get_bortle(lng, lat)
 
-    object_type is either `sun` or `moon` in our case.
 
-    The goal of this function is to ensure that for any pair, setting time
-    PRECEDES rising time, since we want Sun-free and Moon-free hours.
+def get_setting_rising_pair(observer, astro_object, current_date, timezone):
+    """Return the setting and rising pair following `current_date`.
+
+    Return a tuple (setting_dt, rising_dt) of datetimes in `timezone`.
+    observer.date should be set to `current_date` (UTC) by the caller, and it
+    is set back to `current_date` before return, so that the caller can
+    compute other objects with the same observer.
     """
-    current_date = timezone.localize(datetime.strptime(start_date, "%Y/%m/%d"))
-    current_date = current_date.astimezone(pytz.UTC)  # in UTC
+    # Compute current setting time.
+    setting = observer.next_setting(astro_object)
+    setting_dt = ephem.localtime(setting).astimezone(pytz.UTC)  # UTC
 
-    while len(result_dict) < DAYS_OF_ACTIVITY:
-        observer.date = current_date
+    # Compute next rising time.
+    rising = observer.next_rising(astro_object)
+    rising_dt = ephem.localtime(rising).astimezone(pytz.UTC)  # UTC
 
-        # Compute current setting time.
-        setting = observer.next_setting(astro_object)
-        setting_dt = ephem.localtime(setting).astimezone(pytz.UTC)  # UTC
+    # Check if rising is after setting. If not, compute one more rising
+    # with date incremented by 1.
+    if rising_dt < setting_dt:
+        observer.date = current_date + timedelta(days=1)
 
-        # Compute next rising time.
         rising = observer.next_rising(astro_object)
         rising_dt = ephem.localtime(rising).astimezone(pytz.UTC)  # UTC
+        observer.date = current_date
 
-        # Check if rising is after setting. If not, compute one more rising
-        # with date incremented by 1.
+        # If second rising time is still less than setting time,
+        # raise a ValueError.
         if rising_dt < setting_dt:
-            observer.date = current_date + timedelta(days=1)
+            raise ValueError(
+                f"Error finding rising time following {setting_dt}."
+            )
 
-            rising = observer.next_rising(astro_object)
-            rising_dt = ephem.localtime(rising).astimezone(pytz.UTC)  # UTC
+    # Convert back to local timezone before adding to result.
+    return (setting_dt.astimezone(timezone), rising_dt.astimezone(timezone))
 
-            # If second rising time is still less than setting time,
-            # raise a ValueError.
-            if rising_dt < setting_dt:
-                raise ValueError(
-                    f"Error finding rising time following {setting_dt}."
-                )
 
-        # Convert back to local timezone before adding to result.
-        setting_dt = setting_dt.astimezone(timezone)
-        rising_dt = rising_dt.astimezone(timezone)
+def get_transit(observer, astro_object, rising_dt, current_date):
+    """Compute transit time following the current rising time.
 
-        result_dict.append({
-            "set": setting_dt.strftime("%Y/%m/%d %H:%M"),
-            "rise": rising_dt.strftime("%Y/%m/%d %H:%M")
-        })
+    observer.date is set back to `current_date` before return.
+    """
+    # Search directly from the rising time instead of trying several start
+    # dates and picking the earliest transit after rising.
+    transit = observer.next_transit(astro_object, start=rising_dt)
+    observer.date = current_date
+    return ephem.localtime(transit).astimezone(pytz.UTC)  # UTC
 
-        # Update current_date.
-        current_date = current_date + timedelta(days=1)
 
+def get_rising_setting_pair(observer, astro_object, current_date, timezone):
+    """Return the rising, setting, and transit times after `current_date`.
 
-def get_transit(observer, astro_object, rising_dt, current_date):
-    """Compute transit time following the current rising time."""
-    def compute_next_transit(observer, astro_object, current_date):
-        """Compute next transit time based on current_date."""
-        observer.date = current_date
-        transit = observer.next_transit(astro_object)
-        return ephem.localtime(transit).astimezone(pytz.UTC)  # UTC
+    Return a tuple (rising_dt, setting_dt, transit_dt) of datetimes in
+    `timezone`. observer.date should be set to `current_date` (UTC) by the
+    caller, and it is set back to `current_date` before return.
+    """
+    # Compute current rising time.
+    rising = observer.next_rising(astro_object)
+    rising_dt = ephem.localtime(rising).astimezone(pytz.UTC)  # UTC
 
-    transit_times = []
+    # Compute next setting time.
+    setting = observer.next_setting(astro_object)
+    setting_dt = ephem.localtime(setting).astimezone(pytz.UTC)  # UTC
 
-    # Find transit time based on current_date.
-    transit_times.append(
-        compute_next_transit(observer, astro_object, current_date)
-    )
+    # Compute next transit, time the object reaches its max angle.
+    transit_dt = get_transit(
+        observer, astro_object, rising_dt, current_date
+    )  # UTC
 
-    # Decrement current_date by half a day and compute another transit time.
-    transit_times.append(
-        compute_next_transit(
-            observer, astro_object, current_date - timedelta(days=0.5)
-        )
-    )
+    # Check if setting is after rising. If not, compute one more setting
+    # with date incremented by 1.
+    if setting_dt < rising_dt:
+        current_date_plus_one = current_date + timedelta(days=1)
+        observer.date = current_date_plus_one  # UTC
 
-    # Increment current_date by half a day and compute another transit time.
-    transit_times.append(
-        compute_next_transit(
-            observer, astro_object, current_date + timedelta(days=0.5)
-        )
-    )
+        setting = observer.next_setting(astro_object)
+        setting_dt = ephem.localtime(setting).astimezone(pytz.UTC)  # UTC
 
-    # Find the earliest transit time that is after rising_dt.
-    result = current_date + timedelta(days=10)  # effectively the largest
-    for each_transit_time in transit_times:
-        # Both smaller than result and larger than rising_dt.
-        if rising_dt < each_transit_time < result:
-            result = each_transit_time
+        # If second setting time is still less than rising time,
+        # raise a ValueError.
+        if setting_dt < rising_dt:
+            raise ValueError(
+                f"Error finding setting time following {rising_dt}."
+            )
+    observer.date = current_date
 
-    if result == current_date + timedelta(days=10):
+    # Just to be safe, check that next transit is no later than next set.
+    if transit_dt > setting_dt:
         raise ValueError(
-            f"Error finding transit time following {rising_dt}."
+            f"Next transit {transit_dt} is after next set {setting_dt}."
         )
 
-    return result  # UTC
+    # Convert to local times before adding to result.
+    return (
+        rising_dt.astimezone(timezone), setting_dt.astimezone(timezone),
+        transit_dt.astimezone(timezone)
+    )
+
+
+def get_start_date_utc(start_date, timezone):
+    """Return local midnight of `start_date` (yyyy/mm/dd) in UTC."""
+    current_date = timezone.localize(parse_date(start_date))
+    return current_date.astimezone(pytz.UTC)
 
 
-def get_rising_setting_pairs(
-        start_date, result_dict, astro_object, observer, timezone
-):
-    """Get FOUR rising and setting pairs.
+def get_all_object_activity(context, observer, timezone, start_date):
+    """Get the activities of the sun, the moon, and the Milky Way.
 
-    The goal of this function is to ensure that for any pair, rising time
-    PRECEDES setting time.
+    For each of DAYS_OF_ACTIVITY days starting from `start_date`
+    (yyyy/mm/dd), the earliest date in `context["data"]`, add to context:
+    dark_hours - sunset and the following sunrise.
+    moon_activity - moonset and the following moonrise.
+    milky_way activity - rise, transit, and the following set of the Milky
+        Way center.
+
+    Return:
+    A tuple (dark_hours, moon_free_intervals), so that scoring doesn't need
+    to parse the strings back or compute the moon again.
+    dark_hours - a list of (sunset, sunrise) local times as naive datetimes
+        truncated to minutes, i.e. `context["dark_hours"]` before formatting.
+    moon_free_intervals - a list of (moonset, moonrise) UTC datetimes of
+        all moon-free periods during the dark hours, from
+        `get_moon_free_intervals`.
     """
-    current_date = timezone.localize(datetime.strptime(start_date, "%Y/%m/%d"))
-    current_date = current_date.astimezone(pytz.UTC)  # in UTC
+    current_date = get_start_date_utc(start_date, timezone)
 
-    while len(result_dict) < DAYS_OF_ACTIVITY:
+    bodies = (ephem.Sun(), ephem.Moon(), SAGITTARIUS.copy())
+    dark_hours_dt = []
+    for _ in range(DAYS_OF_ACTIVITY):
         observer.date = current_date
+        dark_hours_dt.append(add_daily_activity(
+            context, observer, bodies, current_date, timezone
+        ))
+        current_date = current_date + timedelta(days=1)
 
-        # Compute current rising time.
-        rising = observer.next_rising(astro_object)
-        rising_dt = ephem.localtime(rising).astimezone(pytz.UTC)  # UTC
+    dark_hours = [(
+        sunset_dt.replace(second=0, microsecond=0, tzinfo=None),
+        sunrise_dt.replace(second=0, microsecond=0, tzinfo=None)
+    ) for sunset_dt, sunrise_dt in dark_hours_dt]
+    # Moon activity above has one pair per day, which skips a night when the
+    # moon doesn't set on a day, so moon-free periods are found separately
+    # from the first sunset to the last sunrise.
+    moon_free_intervals = get_moon_free_intervals(
+        observer, bodies[1], dark_hours_dt[0][0], dark_hours_dt[-1][1]
+    )
+    return (dark_hours, moon_free_intervals)
 
-        # Compute next setting time.
-        setting = observer.next_setting(astro_object)
-        setting_dt = ephem.localtime(setting).astimezone(pytz.UTC)  # UTC
 
-        # Compute next transit, time the object reaches its max angle.
-        transit_dt = get_transit(
-            observer, astro_object, rising_dt, current_date
-        )  # UTC
+def add_daily_activity(context, observer, bodies, current_date, timezone):
+    """Add activities following `current_date` (UTC) into context.
 
-        # Check if setting is after rising. If not, compute one more setting
-        # with date incremented by 1.
-        if setting_dt < rising_dt:
-            current_date_plus_one = current_date + timedelta(days=1)
-            observer.date = current_date_plus_one  # UTC
+    Parameters:
+    bodies - a tuple (sun, moon, sagittarius) of ephem bodies.
 
-            setting = observer.next_setting(astro_object)
-            setting_dt = ephem.localtime(setting).astimezone(pytz.UTC)  # UTC
+    Return:
+    A tuple (sunset, sunrise) of datetimes in `timezone`.
+    """
+    sun, moon, sagittarius = bodies
 
-            # If second setting time is still less than rising time,
-            # raise a ValueError.
-            if setting_dt < rising_dt:
-                raise ValueError(
-                    f"Error finding setting time following {rising_dt}."
-                )
+    sunset_dt, sunrise_dt = get_setting_rising_pair(
+        observer, sun, current_date, timezone
+    )
+    context["dark_hours"].append({
+        "set": format_date_time(sunset_dt),
+        "rise": format_date_time(sunrise_dt)
+    })
 
-        # Just to be safe, check that next transit is no later than next set.
-        if transit_dt > setting_dt:
-            raise ValueError(
-                f"Next transit {transit_dt} is after next set {setting_dt}."
-            )
+    moonset_dt, moonrise_dt = get_setting_rising_pair(
+        observer, moon, current_date, timezone
+    )
+    context["moon_activity"].append({
+        "set": format_date_time(moonset_dt),
+        "rise": format_date_time(moonrise_dt)
+    })
 
-        # Convert to local times before adding to result.
-        rising_dt = rising_dt.astimezone(timezone)
-        setting_dt = setting_dt.astimezone(timezone)
-        transit_dt = transit_dt.astimezone(timezone)
+    rising_dt, setting_dt, transit_dt = get_rising_setting_pair(
+        observer, sagittarius, current_date, timezone
+    )
+    context["milky_way"]["activity"].append({
+        "set": format_date_time(setting_dt),
+        "rise": format_date_time(rising_dt),
+        "transit": format_date_time(transit_dt)
+    })
+    return (sunset_dt, sunrise_dt)
 
-        result_dict.append({
-            "set": setting_dt.strftime("%Y/%m/%d %H:%M"),
-            "rise": rising_dt.strftime("%Y/%m/%d %H:%M"),
-            "transit": transit_dt.strftime("%Y/%m/%d %H:%M")
-        })
 
-        # Update current_date.
-        current_date = current_date + timedelta(days=1)  # still in UTC
+def get_moon_free_intervals(observer, moon, start_dt, end_dt):
+    """Return all moon-free periods that overlap `start_dt` to `end_dt`.
 
+    Both `start_dt` and `end_dt` are timezone-aware datetimes. Rising and
+    setting are when the upper limb of the moon crosses the horizon, so a
+    period is slightly shorter than the time the center of the moon is below
+    the horizon, which errs on the side of the moon being visible.
 
-def get_object_activity(context, object_type):
-    """Get the activity of an astronomical object.
+    Near the poles, the moon may not rise or set at all. The whole period is
+    then moon-free if the moon never rises, and not if it never sets.
 
-    See details of `get_setting_rising_pairs` and `get_rising_setting_pairs`.
+    Return:
+    A sorted list of (moonset, moonrise) UTC datetimes, where each moonrise
+    is followed by the next moonset.
     """
-    # Set up observer geolocation information.
+    try:
+        return find_moon_free_intervals(observer, moon, start_dt, end_dt)
+    except ephem.NeverUpError:
+        return [(start_dt.astimezone(pytz.UTC), end_dt.astimezone(pytz.UTC))]
+    except ephem.AlwaysUpError:
+        return []
+
+
+def find_moon_free_intervals(observer, moon, start_dt, end_dt):
+    """Search moonsets and moonrises for `get_moon_free_intervals`."""
+    moon_free_intervals = []
+    moonset = observer.previous_setting(moon, start=start_dt)
+    moonset_dt = moonset.datetime().replace(tzinfo=pytz.UTC)
+    while moonset_dt < end_dt:
+        moonrise = observer.next_rising(moon, start=moonset)
+        moonrise_dt = moonrise.datetime().replace(tzinfo=pytz.UTC)
+        # The moon may have risen again before start_dt.
+        if moonrise_dt > start_dt:
+            moon_free_intervals.append((moonset_dt, moonrise_dt))
+        moonset = observer.next_setting(moon, start=moonrise)
+        moonset_dt = moonset.datetime().replace(tzinfo=pytz.UTC)
+    return moon_free_intervals
+
+
+def create_observer(lat, lng):
+    """Return an ephem observer located at (lat, lng)."""
     observer = ephem.Observer()
-    observer.lat = str(context["lat"])
-    observer.lon = str(context["lng"])
-    timezone = pytz.timezone(context["timezone"])
-
-    # Find start date.
-    all_dates = [key for (key, value) in context["data"].items()]
-    start_date = sorted(all_dates)[0]  # earliest of all
-
-    # Determine the astronomical object and the location to store the results
-    # based on object type.
-    if object_type == "sun":
-        astro_object = ephem.Sun()
-        result_dict = context["dark_hours"]
-
-        get_setting_rising_pairs(
-            start_date, result_dict, astro_object, observer, timezone
-        )
-    elif object_type == "moon":
-        astro_object = ephem.Moon()
-        result_dict = context["moon_activity"]
+    # lat and lng should be strings.
+    observer.lat = str(lat)
+    observer.lon = str(lng)
+    return observer
 
-        get_setting_rising_pairs(
-            start_date, result_dict, astro_object, observer, timezone
-        )
-    elif object_type == "milky_way":
-        astro_object = ephem.readdb(
-            "Sgr,f|C|F7,17:58:03.470,-26:06:04.6,1.00,2000"
-        )  # Sagittarius, constellation at Milky Way center
-        result_dict = context["milky_way"]["activity"]
-
-        get_rising_setting_pairs(
-            start_date, result_dict, astro_object, observer, timezone
-        )
-    else:
-        raise TypeError(f"Invalid object type: {object_type}")
+
+@functools.lru_cache(maxsize=None)
+def get_pytz_timezone(timezone_name):
+    """Return the pytz timezone named `timezone_name`, cached by name."""
+    return pytz.timezone(timezone_name)
 
 
 def get_light_pollution_score(park_id=None, coordinates=None):
@@ -381,38 +564,27 @@ def get_light_pollution_score(park_id=None, coordinates=None):
     2 - average (Bortle 5)
     3 - poor (Bortle 6 and above)
     """
-    bortle_class = get_bortle_class(park_id, coordinates)
-    if bortle_class == 1:
-        return 0
-    if bortle_class <= 4:
-        return 1
-    if bortle_class == 5:
-        return 2
-    return 3
+    if park_id is not None and coordinates is None:
+        return get_park_light_pollution_score(str(park_id))
+    return convert_bortle_class(get_bortle_class(park_id, coordinates))
 
 
-def get_transparency_score(transparency):
-    """Return transparency score based on transparency value.
+@functools.lru_cache(maxsize=4096)
+def get_park_light_pollution_score(park_id):
+    """Return light pollution score of a park, cached by park_id."""
+    return convert_bortle_class(get_bortle_class(park_id, None))
 
-    Raw transparency value is on the scale of 1 to 5, with 1 being poor and 5
-    being excellent. In score_table.npy, however, transparency is on the
-    scale of 0 to 4, with 0 being excellent and 4 being poor.
-    """
-    transparency = int(transparency)
-    if transparency == 5:
-        return 0
-    if transparency == 4:
+
+def convert_bortle_class(bortle_class):
+    """Convert Bortle class to light pollution score."""
+    if bortle_class < 1:
         return 1
-    if transparency == 3:
-        return 2
-    if transparency == 2:
+    if bortle_class >= len(LIGHT_POLLUTION_SCORES):
         return 3
-    if transparency == 1:
-        return 4
-    raise ValueError(f"Invalid input transparency value {transparency}.")
+    return LIGHT_POLLUTION_SCORES[int(bortle_class)]
 
 
-def get_milky_way_max_angle(result_dict, lat, lng):
+def get_milky_way_max_angle(result_dict, observer):
     """Add Milky Way center max angle to context.
 
     Milky Way center max angle is independent of time and only depends
@@ -422,19 +594,26 @@ def get_milky_way_max_angle(result_dict, lat, lng):
     Requirements:
     latitude and longitude should already be stored into observer.
     """
-    observer = ephem.Observer()
-    observer.lat = str(lat)
-    observer.lon = str(lng)
+    # Coordinates are rounded to 2 decimal places (about 1 km), which changes
+    # the angle by at most 0.01 degrees, so that nearby requests share
+    # cached results.
+    result_dict["max_angle"] = get_milky_way_max_angle_cached(
+        round(math.degrees(observer.lat), 2),
+        round(math.degrees(observer.lon), 2)
+    )
+
 
-    # Create a Sagittarius instance, which represents Milky Way center.
-    sagittarius = ephem.readdb("Sgr,f|C|F7,17:58:03.470,-26:06:04.6,1.00,2000")
+@functools.lru_cache(maxsize=4096)
+def get_milky_way_max_angle_cached(lat, lng):
+    """Return Milky Way center max angle at rounded (lat, lng), cached."""
+    observer = create_observer(lat, lng)
+    # Sagittarius represents Milky Way center.
+    sagittarius = SAGITTARIUS.copy()
 
-    # Compute max angle and add to dict.
-    transit = observer.next_transit(sagittarius)
-    observer.date = transit
+    # Compute max angle at the next transit.
+    observer.date = observer.next_transit(sagittarius)
     sagittarius.compute(observer)
-    result_dict["max_angle"] = \
-        f"{math.degrees(sagittarius.alt):.2f}\u00b0"
+    return f"{math.degrees(sagittarius.alt):.2f}\u00b0"
 
 
 def round_time(time_dt, direction):
@@ -444,80 +623,111 @@ def round_time(time_dt, direction):
     time_dt - input time in datetime format.
     direction - 'up' or 'down' to define the rounding direction.
     """
-    if direction == 'up':
-        if time_dt.minute > 0 or time_dt.second > 0 or time_dt.microsecond > 0:
-            time_dt = time_dt + timedelta(hours=1)
-        return time_dt.replace(minute=0, second=0, microsecond=0)
-    if direction == 'down':
-        return time_dt.replace(minute=0, second=0, microsecond=0)
-    raise ValueError("Direction must be 'up' or 'down'")
+    if direction not in ('up', 'down'):
+        raise ValueError("Direction must be 'up' or 'down'")
+    hour_dt = time_dt.replace(minute=0, second=0, microsecond=0)
+    if direction == 'up' and hour_dt != time_dt:
+        return hour_dt + timedelta(hours=1)
+    return hour_dt
+
 
+def compute_night_scores(context, hours_dt, light_pollution_score,
+                         score_table, moon_free_intervals):
+    """Compute stargazing scores of hours given their local start times.
 
-def is_moon_free(lat, lng, start_time_dt):
-    """Return if the moon is invisible in current hour.
+    An hour scores 1 (poor) if the moon is visible in it. Otherwise its score
+    is looked up in `score_table` by light pollution and transparency, and
+    the table is indexed once for all hours. Hours without transparency data
+    are logged and skipped.
+
+    Parameters:
+    hours_dt - naive local start times of hours.
+    moon_free_intervals - (moonset, moonrise) UTC datetimes from
+        `get_all_object_activity`. An hour is moon-free if it lies within
+        one of them.
 
     Return:
-    True - if the moon is invisible.
-    False - if the moon is visible.
-    NOTE: start_time_dt should be in UTC.
+    A list of scores of the remaining hours.
     """
-    if start_time_dt.tzinfo != pytz.UTC:
-        raise ValueError(
-            "Input time should be in UTC timezone."
-        )
-    if start_time_dt.minute != 0 or start_time_dt.second != 0:
-        raise ValueError(
-            "Input time should be rounded to the nearest hour."
+    start_times, transparency = get_hour_arrays(context, hours_dt)
+    scores, is_scored = score_hours(
+        get_moon_free_mask(moon_free_intervals, start_times), transparency,
+        light_pollution_score, score_table
+    )
+    for i in np.flatnonzero(~is_scored):
+        logger.error(
+            "Ignored error: No available data for %s.", hours_dt[i]
         )
-    observer = ephem.Observer()
-    # lat and lng should be strings.
-    observer.lat = str(lat)
-    observer.lon = str(lng)
-    observer.date = start_time_dt
-    moon = ephem.Moon()
-    moon.compute(observer)
+    return scores[is_scored].tolist()
 
-    # Check if moon is below horizon at start hour.
-    if moon.alt > 0:
-        return False
 
-    # If moon is indeed below horizon at start hour, continue to check if
-    # it is also below horizon at end hour.
-    end_time_dt = start_time_dt + timedelta(hours=1)
-    observer.date = end_time_dt
-    moon.compute(observer)
+def get_hour_arrays(context, hours_dt):
+    """Return arrays of the hours in `hours_dt` for `score_hours`.
 
-    return moon.alt <= 0
+    Return:
+    A tuple (start_times, transparency) of POSIX timestamps of the hour
+    starts and transparency values, which are 0 for hours without data.
+    """
+    local_timezone = get_pytz_timezone(context["timezone"])
+    start_times = np.zeros(len(hours_dt))
+    transparency = np.zeros(len(hours_dt), dtype=int)
+    data = context["data"]
+    for i, hour_dt in enumerate(hours_dt):
+        start_times[i] = local_timezone.localize(hour_dt).timestamp()
+        date, hour = format_date(hour_dt), f"{hour_dt.hour:02d}"
+        hour_data = data.get(date, {}).get(hour)
+        if hour_data is not None:
+            transparency[i] = int(hour_data["transparency"])
+    return (start_times, transparency)
+
+
+def get_moon_free_mask(moon_free_intervals, start_times):
+    """Return if each hour starting at `start_times` is moon-free.
+
+    Parameters:
+    moon_free_intervals - sorted list of disjoint (moonset, moonrise) from
+        `get_moon_free_intervals`.
+    start_times - float array of POSIX timestamps of hour starts.
 
+    Return:
+    A bool array, True if the moon is invisible in the whole hour.
+    """
+    if not moon_free_intervals:
+        return np.zeros(len(start_times), dtype=bool)
+    moonsets = np.array([
+        moonset_dt.timestamp() for moonset_dt, _ in moon_free_intervals
+    ])
+    moonrises = np.array([
+        moonrise_dt.timestamp() for _, moonrise_dt in moon_free_intervals
+    ])
+    # The last interval that starts no later than each hour.
+    idx = np.searchsorted(moonsets, start_times, side="right") - 1
+    return (idx >= 0) & \
+        (start_times + 3600 <= moonrises[np.maximum(idx, 0)])
+
+
+def score_hours(moon_free, transparency, light_pollution_score, score_table):
+    """Numeric core of `compute_night_scores` on arrays of hours.
 
-def compute_hour_score(context, start_time_dt,
-                       light_pollution_score, score_table):
-    """Compute overall stargazing score for an hour given start time.
+    Parameters:
+    moon_free - bool array, True if the moon is invisible in an hour.
+    transparency - int array of transparency values 1 to 5, or 0 if the
+        hour has no data.
 
-    Score table dimensions: [light_pollution][transparency]
     Return:
-    4 - excellent
-    3 - good
-    2 - average
-    1 - poor
+    A tuple (scores, is_scored) of int and bool arrays. An hour is not scored
+    if the moon is invisible but there is no valid transparency data.
     """
-    lat, lng = str(context["lat"]), str(context["lng"])
-    # Moon is above horizon in current hour - return poor.
-    local_timezone = pytz.timezone(context["timezone"])
-    local_time_dt = local_timezone.localize(start_time_dt)
-    utc_time = local_time_dt.astimezone(pytz.UTC)
-    if not is_moon_free(lat, lng, utc_time):
-        return 1
-    # No moon visible - consider light pollution and sky transparency.
-    date = start_time_dt.strftime("%Y/%m/%d")
-    hour = start_time_dt.strftime("%H")
-    if date in context["data"] and hour in context["data"][date]:
-        transparency = int(context["data"][date][hour]["transparency"])
-        transparency_score = get_transparency_score(transparency)
-        return int(score_table[light_pollution_score][transparency_score])
-    raise ValueError(
-        f"No available data for {start_time_dt}."
-    )
+    # Transparency of 1 to 5 maps to transparency score of 4 to 0.
+    is_valid = (transparency >= 1) & (transparency <= 5)
+    transparency_scores = 5 - np.clip(transparency, 1, 5)
+    # Moon is above horizon - poor, otherwise look up the row of the score
+    # table for the light pollution score.
+    scores = np.where(
+        moon_free,
+        score_table[light_pollution_score].take(transparency_scores), 1
+    ).astype(int)
+    return (scores, ~moon_free | is_valid)
 
 
 def compute_final_score(scores):
@@ -531,7 +741,8 @@ def compute_final_score(scores):
     """
     if len(scores) < 5:
         raise ValueError("Insufficient hourly scores.")
-    scores_count = {i: 0 for i in range(1, 5)}
+    # Indexed by score; index 0 is unused.
+    scores_count = [0] * 5
     for score in scores:
         scores_count[score] += 1
     if scores_count[4] >= 3:
@@ -544,9 +755,39 @@ def compute_final_score(scores):
 
 
 def get_timezone(lat, lng):
-    """Compute local timezone at location (lat, lng)."""
-    tf_instance = TimezoneFinder()
-    local_timezone = tf_instance.certain_timezone_at(
-        lat=float(lat), lng=float(lng)
+    """Compute local timezone at location (lat, lng).
+
+    Coordinates are rounded to 3 decimal places (about 100 m) so that nearby
+    requests share cached results.
+    """
+    return get_timezone_cached(round(float(lat), 3), round(float(lng), 3))
+
+
+@functools.lru_cache(maxsize=8192)
+def get_timezone_cached(lat, lng):
+    """Compute local timezone at rounded location (lat, lng), cached."""
+    return get_timezone_finder().timezone_at(lat=lat, lng=lng)
+
+
+@functools.lru_cache(maxsize=1)
+def get_timezone_finder():
+    """Return the TimezoneFinder shared by all lookups.
+
+    Loading timezone polygons takes far longer than a lookup, so they are
+    loaded once, into memory so that threads can share the instance.
+    """
+    return TimezoneFinder(in_memory=True)
+
+
+def dumps_json(context):
+    """Serialize `context` into JSON bytes for a response.
+
+    orjson serializes NumPy scalars and arrays natively. Keys are sorted and
+    Decimal values from the database become strings, same as flask.jsonify.
+    NaN becomes null so that the output is valid JSON.
+    """
+    return orjson.dumps(
+        context, default=str,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS
+        | orjson.OPT_NON_STR_KEYS
     )
-    return local_timezone
@@ -1,11 +1,14 @@
 """Data server configuration."""
 import json
 import pathlib
+import threading
 from psycopg2 import pool
 APPLICATION_ROOT = "/"
 SERVER_ROOT = pathlib.Path(__file__).resolve().parent.parent
 DOWNLOAD_FOLDER = SERVER_ROOT/"var"
 SCORE_TABLE_PATH = SERVER_ROOT/"data"/"score_table.npy"
+CONVERSION_TABLE_PATH = SERVER_ROOT/"data"/"sky_transparency_table.npy"
+METEOR_SHOWER_TABLE_PATH = SERVER_ROOT/"data"/"meteor_shower_table.json"
 PARKS_DATABASE_NAME = "parks"
 USERS_DATABASE_NAME = "users"
 LIGHT_POLLUTION_DATABASE_NAME = "light_pollution"
@@ -19,7 +22,7 @@ with open(
 ) as file:
     config = json.load(file)
 
-# Create a connection pool for database `parks`.
+# Connection parameters of database `parks`.
 PARKS_DATABASE = {
     "database": PARKS_DATABASE_NAME,
     "user": DATABASE_USER,
@@ -28,10 +31,7 @@ PARKS_DATABASE = {
     "port": 5432,
 }
 
-# TODO: adjust min and max accordingly.
-parks_connection_pool = pool.ThreadedConnectionPool(1, 10, **PARKS_DATABASE)
-
-# Create a connection pool for database `users`.
+# Connection parameters of database `users`.
 USERS_DATABASE = {
     "database": USERS_DATABASE_NAME,
     "user": DATABASE_USER,
@@ -40,8 +40,6 @@ USERS_DATABASE = {
     "port": 5432,
 }
 
-users_connection_pool = pool.ThreadedConnectionPool(1, 10, **USERS_DATABASE)
-
 LIGHT_POLLUTION_DATABASE = {
     "database": LIGHT_POLLUTION_DATABASE_NAME,
     "user": DATABASE_USER,
@@ -50,8 +48,27 @@ LIGHT_POLLUTION_DATABASE = {
     "port": 5432,
 }
 
-light_pollution_connection_pool = pool.ThreadedConnectionPool(
-    1, 10, **LIGHT_POLLUTION_DATABASE
-)
+# Connection pools are created on first use instead of at import, so that
+# importing the app (e.g. before workers fork) doesn't connect to databases.
+# {database name: pool}
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+databases = {
+    PARKS_DATABASE_NAME: PARKS_DATABASE,
+    USERS_DATABASE_NAME: USERS_DATABASE,
+    LIGHT_POLLUTION_DATABASE_NAME: LIGHT_POLLUTION_DATABASE,
+}
+
+
+def get_connection_pool(database_name):
+    """Return the connection pool of `database_name`, created on first use."""
+    with connection_pools_lock:
+        if database_name not in connection_pools:
+            # TODO: adjust min and max accordingly.
+            connection_pools[database_name] = pool.ThreadedConnectionPool(
+                1, 10, **databases[database_name]
+            )
+        return connection_pools[database_name]
+
 
 print("Data server configuration complete.")
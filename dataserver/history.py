@@ -2,14 +2,15 @@
 
 Get historical data exactly once before deployment.
 """
+import calendar
 import concurrent.futures
 import os
-import subprocess
-from datetime import datetime, timedelta
 import numpy as np
+from botocore.exceptions import ClientError
 from dataserver.config import SERVER_ROOT
 from dataserver import model
-from bin.dataserver_download import downloader
+from bin.dataserver_download import downloader, parse_s3_url, S3_CLIENT, \
+    GribProcessPool
 
 
 # Cloud cover and relative humidity
@@ -20,8 +21,18 @@ GEFS_PATH = "s3://noaa-gefs-pds"
 GEFS_FILENAME = "gefs.chem.t12z.a2d_0p25.f000.grib2"
 # Time span: 12 years (right exclusive)
 DATA_TIME = 12
-# Maximum number of `downloader` threads
-MAX_WORKERS = 1
+# Maximum number of `downloader` threads. Downloads are bound by S3 latency
+# rather than CPU, so many files are fetched concurrently.
+MAX_WORKERS = 24
+# Number of times a history file is downloaded before it is given up
+MAX_DOWNLOAD_ATTEMPTS = 3
+# Rows of the grid whose median is computed at once. Each block holds this
+# many rows of every file in memory: 8 rows of 1440 float32 values in about
+# 360 files are 16 MB, which stays close to the CPU cache while the median
+# is selected.
+MEDIAN_BLOCK_ROWS = 8
+# Maximum number of threads that check if urls exist
+PROBE_WORKERS = 32
 
 
 # pylint: disable=too-few-public-methods
@@ -42,6 +53,8 @@ class HistoryTransparency:
         self.month = input_month
 
         self.gfs_urls, self.gefs_urls = [], []
+        # Median arrays computed by `_process_files`, keyed by data type.
+        self.medians = {}
 
     def start(self):
         """Start downloading and processing files."""
@@ -88,18 +101,7 @@ class HistoryTransparency:
         # in the database; urls at the end are missing because they are
         # in the distant future and do not exist yet.)
         # The contiguous chunk of urls in the middle is guaranteed to exist.
-        for url in urls:
-            # False if current url exists and is NOT removed.
-            url_is_removed = remove_nonexistence_file(url, urls)
-            if not url_is_removed:
-                # We've found the first existing url in the list.
-                break
-
-        for url in reversed(urls):
-            url_is_removed = remove_nonexistence_file(url, urls)
-            if not url_is_removed:
-                # We've found the last existing url in the list.
-                break
+        urls = trim_missing_urls(urls)
 
         if url_type == "GFS":
             self.gfs_urls = urls
@@ -127,16 +129,41 @@ class HistoryTransparency:
             dest_dir = SERVER_ROOT / "history_data" / f"{self.month}" / \
                 "gefs" / f"gefs.f{idx:03d}"
             gefs_file_transfer_info.append((url, dest_dir))
-        # Join the two lists into a set.
-        file_list = set(gfs_file_transfer_info) | \
-            set(gefs_file_transfer_info)
-        file_list_copy = file_list.copy()
-        # Download files with `downloader` threads.
+        # Urls are unique per day and data type, so the two lists don't
+        # overlap and need no deduplication.
+        file_list = gfs_file_transfer_info + gefs_file_transfer_info
+        # Download files with `downloader` threads, which share one S3
+        # client. GRIB files are processed in separate processes.
         with concurrent.futures.ThreadPoolExecutor(
-                max_workers=MAX_WORKERS) as executor:
-            _ = [executor.submit(
-                downloader, file_transfer_info, file_list
-            ) for file_transfer_info in file_list_copy]
+                max_workers=MAX_WORKERS) as executor, \
+                GribProcessPool() as process_pool:
+            # {future: (file_transfer_info, attempt)}
+            futures = {
+                executor.submit(
+                    downloader, file_transfer_info, process_pool
+                ): (file_transfer_info, 1)
+                for file_transfer_info in file_list
+            }
+            failed = []
+            while futures:
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    file_transfer_info, attempt = futures.pop(future)
+                    # downloader logs its errors and returns False on failure.
+                    if future.result():
+                        continue
+                    # Files are known to exist, so failures are transient.
+                    # Retry right away while other downloads continue.
+                    if attempt < MAX_DOWNLOAD_ATTEMPTS:
+                        futures[executor.submit(
+                            downloader, file_transfer_info, process_pool
+                        )] = (file_transfer_info, attempt + 1)
+                    else:
+                        failed.append(file_transfer_info[0])
+        if failed:
+            print(f"Failed to download {len(failed)} files: {failed}")
 
     def _process_files(self):
         """Download and preprocess one file.
@@ -172,35 +199,35 @@ class HistoryTransparency:
         cloud_median = get_median_array(cloud_file_paths)
         humidity_median = get_median_array(humidity_file_paths)
         aerosol_median = get_median_array(aerosol_file_paths)
-        # Save the results.
+        # Save the results. They are also kept for `_get_transparency`.
         directory = str(SERVER_ROOT/"history_data"/f"{self.month}")
         np.save(f"{directory}/cloud.npy", cloud_median)
         np.save(f"{directory}/humidity.npy", humidity_median)
         np.save(f"{directory}/aerosol.npy", aerosol_median)
+        self.medians = {
+            "cloud": cloud_median,
+            "humidity": humidity_median,
+            "aerosol": aerosol_median,
+        }
 
     def _get_transparency(self):
         """Compute transparency based on cloud, humidity and aerosol."""
-        # Load the conversion table.
-        table = np.load(SERVER_ROOT/"data"/"sky_transparency_table.npy")
-        # Load cloud, humidity, and aerosol data.
+        table = model.get_conversion_table()
+        # Use cloud, humidity, and aerosol data of `_process_files`, or load
+        # them if they were processed by an earlier run.
         current_month_directory = SERVER_ROOT/"history_data"/f"{self.month}"
-        cloud = np.load(current_month_directory/"cloud.npy")
-        humidity = np.load(current_month_directory/"humidity.npy")
-        aerosol = np.load(current_month_directory/"aerosol.npy")
-        # Compute the results.
-        height, width = np.shape(cloud)
-        result = np.zeros(shape=((height, width)))
-        for row in range(height):
-            for col in range(width):
-                cloud_idx = model.get_cloud_humidity_index(cloud[row][col])
-                humidity_idx = model.get_cloud_humidity_index(
-                    humidity[row][col]
-                )
-                aerosol_idx = model.get_aerosol_index(aerosol[row][col])
-                # Look up the conversion table.
-                result[row][col] = table[cloud_idx][humidity_idx][aerosol_idx]
-        # Save the result as int type.
-        result = result.astype(int)
+        cloud, humidity, aerosol = (
+            self.medians[data_type] if data_type in self.medians
+            else np.load(current_month_directory/f"{data_type}.npy")
+            for data_type in ("cloud", "humidity", "aerosol")
+        )
+        # Compute the indices of all grid points at once.
+        cloud_idx = model.get_cloud_humidity_indices(cloud)
+        humidity_idx = model.get_cloud_humidity_indices(humidity)
+        aerosol_idx = model.get_aerosol_indices(aerosol)
+        # Look up the conversion table. Transparency is 1 to 5, so the
+        # result is saved as int8.
+        result = table[cloud_idx, humidity_idx, aerosol_idx].astype(np.int8)
         np.save(current_month_directory/"transparency.npy", result)
 
 
@@ -210,25 +237,11 @@ def get_days_in_month(year, month):
 
     year and month should be integers.
     """
-    start_date = datetime(year, month, 1)
-
-    # Calculate the number of days in the month
-    if month == 12:
-        end_date = datetime(year + 1, 1, 1)
-    else:
-        end_date = datetime(year, month + 1, 1)
-
-    # Subtract one day to get the last day of the current month
-    end_date -= timedelta(days=1)
-
-    # Generate a list of all the days in the month in YYYYMMDD format.
-    all_days = []
-    current_date = start_date
-    while current_date <= end_date:
-        all_days.append(current_date.date().strftime("%Y%m%d"))
-        current_date += timedelta(days=1)
-
-    return all_days
+    num_days = calendar.monthrange(year, month)[1]
+    # All days in the month in YYYYMMDD format.
+    return [
+        f"{year:04d}{month:02d}{day:02d}" for day in range(1, num_days + 1)
+    ]
 
 
 def check_input_month(input_month):
@@ -268,31 +281,54 @@ def check_start_end_years(start_year, end_year):
         )
 
 
-def remove_nonexistence_file(file_url, all_urls):
-    """Check if file_url exists and remove it from all_urls if not.
+def file_exists(file_url):
+    """Return True if the S3 object at file_url exists."""
+    bucket, key = parse_s3_url(file_url)
+    try:
+        S3_CLIENT.head_object(Bucket=bucket, Key=key)
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return False
+        raise
+    return True
+
+
+def trim_missing_urls(all_urls):
+    """Return all_urls without the missing urls at its front and end.
 
-    Return True if a non-existent url is removed and return False otherwise.
+    All urls are checked concurrently since each check is a network round
+    trip.
     """
-    result = subprocess.run(
-                f"aws s3 ls --no-sign-request {file_url}",
-                shell=True, capture_output=True, text=True, check=True
-            )
-    # Remove the url if it does not exist.
-    output = result.stdout
-    if len(output) == 0:
-        all_urls.remove(file_url)
-        # A file has indeed been removed.
-        return True
-    # The file exists and is not removed.
-    return False
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=PROBE_WORKERS) as executor:
+        exists = list(executor.map(file_exists, all_urls))
+    if True not in exists:
+        return []
+    first = exists.index(True)
+    last = len(exists) - exists[::-1].index(True)
+    return all_urls[first:last]
 
 
 def get_median_array(all_file_paths):
     """Load all numpy arrays and return the median array.
 
+    Files are memory-mapped and the median is computed MEDIAN_BLOCK_ROWS rows
+    at a time, so only one block of rows of all files is in memory at once
+    instead of all arrays. Blocks are converted to float32, which is also the
+    type of the result. Values of one grid point are stacked along the last
+    axis, so that the median selection of each point reads contiguous memory.
+    Blocks are temporary, so the median partitions them in place.
+
     Parameter:
     all_file_paths - a list of file full paths.
     """
-    array_list = [np.load(file_path) for file_path in all_file_paths]
-    stacked_array = np.stack(array_list, axis=0)
-    return np.median(stacked_array, axis=0)
+    array_list = [
+        np.load(file_path, mmap_mode="r") for file_path in all_file_paths
+    ]
+    num_rows = len(array_list[0])
+    return np.concatenate([
+        np.median(np.stack([
+            array[start:start + MEDIAN_BLOCK_ROWS] for array in array_list
+        ], axis=-1, dtype=np.float32), axis=-1, overwrite_input=True)
+        for start in range(0, num_rows, MEDIAN_BLOCK_ROWS)
+    ], axis=0)
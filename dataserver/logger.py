@@ -1,13 +1,54 @@
 """Set up a logger to be used by any module of the data server."""
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import multiprocessing
+import os
+import queue
+from logging.handlers import TimedRotatingFileHandler, WatchedFileHandler, \
+    QueueHandler, QueueListener
 
 
-def setup_logger(log_file_name):
-    """Initialize a logger that writes to log_file_name."""
-    logger_instance = logging.getLogger(__name__)
+FORMATTER = logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+
+def get_direct_handlers(log_file_name):
+    """Return handlers that write records of a child process directly.
+
+    Only the main process rotates the log file. WatchedFileHandler never
+    rotates it, and reopens it after the main process does.
+    """
+    handlers = [WatchedFileHandler(log_file_name), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(FORMATTER)
+    return handlers
+
+
+def setup_logger(log_file_name, name=__name__):
+    """Initialize a logger that writes to log_file_name.
+
+    In the main process, log calls only put records into a queue. A
+    background thread writes them to the file and the console, so that
+    request threads don't wait on file I/O or on each other.
+
+    Child processes, e.g. workers of process pools, write their records
+    directly. The listener thread doesn't survive a fork, and records left
+    in a queue are lost when a worker exits. This includes web server
+    workers forked after the app is loaded (gunicorn --preload): a fork
+    hook swaps the queue handler for direct handlers in each worker, so
+    queueing only applies to the process that imported this module.
+    """
+    logger_instance = logging.getLogger(name)
     logger_instance.setLevel(logging.DEBUG)
 
+    # Workers started by spawn or forkserver import this module themselves.
+    if multiprocessing.current_process().name != "MainProcess":
+        for handler in get_direct_handlers(log_file_name):
+            logger_instance.addHandler(handler)
+        return logger_instance
+
     handler = TimedRotatingFileHandler(
         filename=log_file_name, when="D", interval=1, backupCount=14
     )
@@ -16,14 +57,25 @@ def setup_logger(log_file_name):
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.DEBUG)
 
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    handler.setFormatter(FORMATTER)
+    console_handler.setFormatter(FORMATTER)
+
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    logger_instance.addHandler(queue_handler)
+    listener = QueueListener(
+        queue_handler.queue, handler, console_handler,
+        respect_handler_level=True
     )
-    handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+    listener.start()
+    atexit.register(listener.stop)
+
+    def use_direct_handlers():
+        """Replace the queue handler in a forked child."""
+        logger_instance.removeHandler(queue_handler)
+        for direct_handler in get_direct_handlers(log_file_name):
+            logger_instance.addHandler(direct_handler)
 
-    logger_instance.addHandler(handler)
-    logger_instance.addHandler(console_handler)
+    os.register_at_fork(after_in_child=use_direct_handlers)
 
     return logger_instance
 
@@ -1,14 +1,22 @@
 """Utility functions for the world model."""
+import functools
+import math
 import flask
 import numpy as np
 import dataserver
-from dataserver.config import parks_connection_pool, users_connection_pool, \
-    light_pollution_connection_pool
+from dataserver.config import get_connection_pool, PARKS_DATABASE_NAME, \
+    USERS_DATABASE_NAME, LIGHT_POLLUTION_DATABASE_NAME, CONVERSION_TABLE_PATH
+
+
+# The 0.25 degree grid of dataserver.LATS and dataserver.LNGS: latitudes
+# 90, 89.75, ..., -90 and longitudes 0, 0.25, ..., 359.75.
+GRID_RESOLUTION = 0.25
+NUM_LNGS = 1440
 
 
 # NOTE: I tried to reduce code duplication here but it didn't work. It seems
 # that flask.g only accepts literal values as its keys instead of variables.
-# E.g. flask.g.parks_db = parks_connection_pool.getconn() works but
+# E.g. flask.g.parks_db = pool.getconn() works but
 # flask.g[key] where `key` is a variable (function parameter) does not work.
 
 
@@ -29,7 +37,8 @@ def get_parks_db():
     processing, whereas the app server is responsible for searching.
     """
     if "parks_db" not in flask.g:
-        flask.g.parks_db = parks_connection_pool.getconn()
+        flask.g.parks_db = \
+            get_connection_pool(PARKS_DATABASE_NAME).getconn()
     return flask.g.parks_db  # returns a connection
 
 
@@ -40,13 +49,16 @@ def close_parks_db(error=None):
     database_connection = flask.g.pop("parks_db", None)
     if database_connection is not None:
         database_connection.commit()
-        parks_connection_pool.putconn(database_connection)
+        get_connection_pool(PARKS_DATABASE_NAME).putconn(
+            database_connection
+        )
 
 
 def get_users_db():
     """Get a connection to `users` database."""
     if "users_db" not in flask.g:
-        flask.g.users_db = users_connection_pool.getconn()
+        flask.g.users_db = \
+            get_connection_pool(USERS_DATABASE_NAME).getconn()
     return flask.g.users_db
 
 
@@ -57,14 +69,16 @@ def close_users_db(error=None):
     database_connection = flask.g.pop("users_db", None)
     if database_connection is not None:
         database_connection.commit()
-        users_connection_pool.putconn(database_connection)
+        get_connection_pool(USERS_DATABASE_NAME).putconn(
+            database_connection
+        )
 
 
 def get_light_pollution_db():
     """Establish a connection to `light_pollution` database."""
     if "light_pollution_db" not in flask.g:
         flask.g.light_pollution_db = \
-            light_pollution_connection_pool.getconn()
+            get_connection_pool(LIGHT_POLLUTION_DATABASE_NAME).getconn()
     return flask.g.light_pollution_db
 
 
@@ -75,14 +89,18 @@ def close_light_pollution_db(error=None):
     database_connection = flask.g.pop("light_pollution_db", None)
     if database_connection is not None:
         database_connection.commit()
-        light_pollution_connection_pool.putconn(database_connection)
+        get_connection_pool(LIGHT_POLLUTION_DATABASE_NAME).putconn(
+            database_connection
+        )
 
 
 def get_lat_idx(target_lat):
     """Return the matrix index of target latitude."""
     if target_lat > 90 or target_lat < -90:
         raise ValueError("Latitude out of range. -90 <= lat <= 90")
-    return np.abs(dataserver.LATS[:, 0] - target_lat).argmin()
+    # Latitudes in the grid go from 90 down to -90. Round to the nearest one,
+    # with ties going to the lower index.
+    return math.ceil((90 - target_lat) / GRID_RESOLUTION - 0.5)
 
 
 def get_lng_idx(target_lng):
@@ -91,7 +109,11 @@ def get_lng_idx(target_lng):
         raise ValueError("Longitude out of range. -180 <= lng <= 180")
     # Values in LNGS range from 0 to 360 - offset target_lng by 180.
     target_lng += 180
-    return np.abs(dataserver.LNGS - target_lng).argmin()
+    # Round to the nearest longitude, with ties going to the lower index.
+    # Longitudes past the last one (359.75) map to it.
+    return min(
+        math.ceil(target_lng / GRID_RESOLUTION - 0.5), NUM_LNGS - 1
+    )
 
 
 def get_cloud_humidity_index(input_percentage):
@@ -128,3 +150,43 @@ def get_aerosol_index(aerosol):
     if aerosol < 0.3:
         return 1
     return 2
+
+
+# Bin edges of the index functions above, used by their array versions.
+CLOUD_HUMIDITY_BINS = np.array([20, 40])
+AEROSOL_BINS = np.array([0.1, 0.3])
+
+
+@functools.lru_cache(maxsize=1)
+def get_conversion_table():
+    """Return the sky transparency table, loaded once per process.
+
+    Dimensions: [cloud index][humidity index][aerosol index]. The table is
+    shared by all callers, so it is read-only.
+    """
+    table = np.load(CONVERSION_TABLE_PATH)
+    table.setflags(write=False)
+    return table
+
+
+def get_cloud_humidity_indices(input_percentages):
+    """Return cloud/humidity indices of an array of percentages.
+
+    Array version of `get_cloud_humidity_index`. NaN entries map to the
+    high index 2, same as the scalar version.
+    """
+    input_percentages = np.asarray(input_percentages, dtype=float)
+    if np.any((input_percentages < 0) | (input_percentages > 100)):
+        raise ValueError(
+            f"Invalid cloud/humidity input {input_percentages}. "
+            "Should be between 0 and 100."
+        )
+    return np.digitize(input_percentages, CLOUD_HUMIDITY_BINS)
+
+
+def get_aerosol_indices(aerosols):
+    """Return aerosol indices of an array of aerosol concentrations.
+
+    Array version of `get_aerosol_index`. NaN entries map to 2.
+    """
+    return np.digitize(np.asarray(aerosols, dtype=float), AEROSOL_BINS)
@@ -1,4 +1,5 @@
 """Functions that process downloaded datasets."""
+import contextlib
 import os
 import shutil
 from datetime import datetime, timedelta
@@ -10,18 +11,35 @@ from dataserver.logger import logger
 MAX_WORKERS = 1
 INT_MAX = 2**32 - 1
 DATA_RETENTION_DAYS = 2
+MAX_PREDICTION_HOURS = 72
+# {data_type: (forecast types, hours between two forecasts)}
+FORECAST_TYPES = {"gfs": (("cloud", "humidity"), 1), "gefs": (("aerosol",), 3)}
+# {forecast type: (name, typeOfLevel)} of GFS messages to extract
+GFS_MESSAGES = {
+    "cloud": ("Total Cloud Cover", "atmosphere"),
+    "humidity": ("Relative humidity", "atmosphereSingleLayer"),
+}
 
 
 def process(current_date, current_time):
     """Process downloaded data.
 
     It extracts information (TCDC, RH, aerosol) from downloaded datasets,
-    deletes raw data, and deletes stale data from 3 days ago.
+    deletes raw data, and deletes stale data from DATA_RETENTION_DAYS days
+    ago.
     """
     logger.info(
         "%s/%s data processing starts.", current_date, current_time
     )
 
+    # Stack hourly forecasts so that API reads one file per forecast type.
+    for data_type, (forecast_types, hour_step) in FORECAST_TYPES.items():
+        for forecast_type in forecast_types:
+            stack_forecasts(
+                f"data/{current_date}/{current_time}/{data_type}",
+                forecast_type, hour_step
+            )
+
     # Mark the processing as complete.
     completion_flag = f"data/{current_date}/{current_time}/complete.flag"
     with open(completion_flag, "w", encoding="utf-8") as file:
@@ -45,14 +63,6 @@ def process_gfs_file(file_path):
         - extracts TCDC (total cloud cover) and RH (relative humidity).
         - deletes original (large) file.
     """
-    gribs = pygrib.open(file_path)
-    selected_cloud_gribs = gribs.select(
-        name="Total Cloud Cover", typeOfLevel="atmosphere"
-    )
-    selected_humidity_gribs = gribs.select(
-        name="Relative humidity", typeOfLevel="atmosphereSingleLayer"
-    )
-
     path_segments = file_path.split("/")
     filename = path_segments[-1]
     name_segments = filename.split(".")
@@ -61,12 +71,21 @@ def process_gfs_file(file_path):
     if len(directory_path) == 0:
         directory_path = "."
 
-    process_selected_gribs(
-        selected_cloud_gribs, "cloud", directory_path, forecast_hour
-    )
-    process_selected_gribs(
-        selected_humidity_gribs, "humidity", directory_path, forecast_hour
-    )
+    with contextlib.closing(pygrib.open(file_path)) as gribs:
+        # Sort messages by type in one pass over the file instead of one
+        # `select` pass per type. Values are decoded later, only for
+        # selected messages.
+        selected_gribs = {gribs_type: [] for gribs_type in GFS_MESSAGES}
+        for grib in gribs:
+            for gribs_type, (name, type_of_level) in GFS_MESSAGES.items():
+                if getattr(grib, "name", None) == name and \
+                        getattr(grib, "typeOfLevel", None) == type_of_level:
+                    selected_gribs[gribs_type].append(grib)
+
+        for gribs_type, gribs_of_type in selected_gribs.items():
+            process_selected_gribs(
+                gribs_of_type, gribs_type, directory_path, forecast_hour
+            )
 
     os.remove(file_path)
 
@@ -116,6 +135,7 @@ def process_gefs_file(file_path):
         filtered_grib, "aerosol", directory_path, forecast_hour
     )
 
+    gribs.close()
     os.remove(file_path)
 
 
@@ -143,12 +163,13 @@ def process_selected_gribs(gribs, gribs_type, directory_path, forecast_hour):
     min_nan_entries = INT_MAX
     selected_data = None
     for grib in gribs:
-        num_nan_entries = np.sum(np.isnan(grib.values))
+        # pygrib decodes the message on every access to `values`.
+        values = grib.values
+        num_nan_entries = np.count_nonzero(np.isnan(values))
         if num_nan_entries < min_nan_entries:
             min_nan_entries = num_nan_entries
-            selected_data = grib.values
-    height, width = np.shape(selected_data)
-    if min_nan_entries == height * width:
+            selected_data = values
+    if min_nan_entries == selected_data.size:
         raise ValueError(
             f"All entries in {directory_path}/{gribs_type}.{forecast_hour} "
             "are NaN."
@@ -158,8 +179,38 @@ def process_selected_gribs(gribs, gribs_type, directory_path, forecast_hour):
     )
 
 
+def stack_forecasts(directory_path, forecast_type, hour_step):
+    """Stack hourly forecast files into one array and delete them.
+
+    E.g. cloud.f000.npy, ..., cloud.f071.npy in directory_path are stacked
+    into cloud.npy of shape (72, lat, lng). The array is written through a
+    memory map, so only one hourly grid is held in memory at a time.
+
+    Parameters:
+    directory_path - e.g. data/20770101/06/gfs
+    forecast_type - cloud, humidity, or aerosol.
+    hour_step - hours between two forecast files, 3 for aerosol.
+    """
+    paths = [
+        f"{directory_path}/{forecast_type}.f{hour:03d}.npy"
+        for hour in range(0, MAX_PREDICTION_HOURS, hour_step)
+    ]
+    first_grid = np.load(paths[0], mmap_mode="r")
+    stacked = np.lib.format.open_memmap(
+        f"{directory_path}/{forecast_type}.npy", mode="w+",
+        dtype=first_grid.dtype, shape=(len(paths), *first_grid.shape)
+    )
+    for i, path in enumerate(paths):
+        stacked[i] = np.load(path, mmap_mode="r")
+    stacked.flush()
+    del stacked
+
+    for path in paths:
+        os.remove(path)
+
+
 def delete_stale_data(current_date):
-    """Delete stale data (entire directory) from 3 days ago.
+    """Delete stale data (entire directory) from DATA_RETENTION_DAYS days ago.
 
     Parameter:
     current_date - a STRING that represents current date in YYYYMMDD format.
@@ -72,8 +72,7 @@ def get_light_pollution_score(boundary, unit_name):
         samples = polygon.sample_polygon(poly, num_samples)
         total_samples += len(samples)
 
-        for sample in samples:
-            lng, lat = sample[0], sample[1]
-            bortle_class = bortle.get_bortle(lng, lat)
+        # One query for all samples of the polygon.
+        for bortle_class in bortle.get_bortle_bulk(samples):
             counts[bortle_class] += 1
     return compute_dominant_bortle_class(counts, total_samples, unit_name)
@@ -56,22 +56,78 @@ def get_brightness(lng, lat):
     return data[0]
 
 
-def get_sqm(lng, lat):
-    """Return the Sky Quality Meter(SQM) at location (lng, lat)."""
-    art_brightness = get_brightness(lng, lat)
+def get_brightness_bulk(points):
+    """Read the brightness values at a list of (lng, lat) points.
+
+    All points are looked up in one query instead of one query per point.
+    Return a list of brightness values in the order of `points`.
+    """
+    lngs = [float(lng) for lng, _ in points]
+    lats = [float(lat) for _, lat in points]
+    connection = get_light_pollution_db()
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT points.idx, ST_Value(rast, points.geom) "
+        "FROM (SELECT idx, ST_SetSRID(ST_Point(lng, lat), 4326) AS geom "
+        "      FROM unnest(%s::float8[], %s::float8[]) "
+        "      WITH ORDINALITY AS p(lng, lat, idx)) AS points "
+        "JOIN public.light_pollution "
+        "ON ST_Intersects(rast, points.geom);",
+        (lngs, lats, )
+    )
+
+    brightness = {}
+    for idx, value in cursor.fetchall():
+        # A point on the border of two tiles matches both; keep the first
+        # like `get_brightness` does.
+        brightness.setdefault(idx, value)
+
+    # WITH ORDINALITY numbers points from 1.
+    missing = [
+        points[idx - 1] for idx in range(1, len(points) + 1)
+        if brightness.get(idx) is None
+    ]
+    if missing:
+        raise ValueError(f"No light pollution data for points {missing}")
+
+    return [brightness[idx] for idx in range(1, len(points) + 1)]
+
+
+def brightness_to_sqm(art_brightness):
+    """Convert artificial brightness to Sky Quality Meter(SQM)."""
     total_brightness = art_brightness + 0.171168465
     sqm = np.log10(total_brightness / 108000000) / (-0.4)
     return sqm
 
 
-# pylint: disable=R1716,R0911
+def get_sqm(lng, lat):
+    """Return the Sky Quality Meter(SQM) at location (lng, lat)."""
+    return brightness_to_sqm(get_brightness(lng, lat))
+
+
 def get_bortle(lng, lat):
-    """Compute the Bortle class for a given location.
+    """Compute the Bortle class for a given location."""
+    lng, lat = float(lng), float(lat)  # allows string inputs
+    return sqm_to_bortle(get_sqm(lng, lat))
+
+
+def get_bortle_bulk(points):
+    """Compute the Bortle classes of a list of (lng, lat) points.
+
+    Return a list of Bortle classes in the order of `points`.
+    """
+    if not points:
+        return []
+    sqms = brightness_to_sqm(np.array(get_brightness_bulk(points)))
+    return [sqm_to_bortle(sqm) for sqm in sqms]
+
+
+# pylint: disable=R1716,R0911
+def sqm_to_bortle(sqm):
+    """Convert Sky Quality Meter(SQM) to Bortle class.
 
     SQM to Bortle conversion table: https://www.handprint.com/ASTRO/bortle.html
     """
-    lng, lat = float(lng), float(lat)  # allows string inputs
-    sqm = get_sqm(lng, lat)
     if sqm >= 21.99:
         return 1
     if sqm >= 21.89:
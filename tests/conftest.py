@@ -0,0 +1,16 @@
+"""Fixtures shared by the tests."""
+import pytest
+
+
+@pytest.fixture
+def isolated_data(tmp_path, monkeypatch):
+    """Run a test in an empty temporary working directory.
+
+    The data server reads and writes data/ and tmp/ relative to the working
+    directory, so each test gets its own copies that pytest removes
+    afterwards. Yields the path of the empty data/ directory.
+    """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "tmp").mkdir()
+    yield tmp_path / "data"
@@ -1,11 +1,12 @@
 """Test automatic download script."""
 import concurrent.futures
+from datetime import datetime
 import os
 import subprocess
 import time
 import requests
 import pytest
-from ratelimiter import RateLimiter
+from botocore.exceptions import ClientError, EndpointConnectionError
 import bin.dataserver_download as dld
 
 
@@ -58,29 +59,117 @@ def test_get_urls():
     os.system("head -n 10 tmp/gefs_content.txt; rm tmp/gefs_content.txt")
 
 
+def test_backoff():
+    """Test backoff sleep time stays within the truncated jitter window."""
+    for attempt in range(dld.MAX_RETRY):
+        upper_bound = min(
+            dld.RETRY_MAX_TIME, dld.RETRY_BASE_TIME * 2 ** attempt
+        )
+        for _ in range(100):
+            assert 0 <= dld.backoff(attempt) <= upper_bound
+
+
+def test_get_next_run():
+    """Test get_next_run finds the next job time, rolling over midnight."""
+    assert dld.get_next_run(datetime(2077, 1, 1, 3, 59)) == \
+        datetime(2077, 1, 1, 4, 0)
+    # A job that is due right now is not run twice.
+    assert dld.get_next_run(datetime(2077, 1, 1, 4, 0)) == \
+        datetime(2077, 1, 1, 10, 0)
+    assert dld.get_next_run(datetime(2077, 1, 1, 22, 30)) == \
+        datetime(2077, 1, 2, 4, 0)
+
+
+def test_parse_s3_url():
+    """Test parse_s3_url splits urls into bucket and key."""
+    assert dld.parse_s3_url(
+        "s3://noaa-gfs-bdp-pds/gfs.20770101/00/atmos/gfs.t00z.pgrb2.0p25.f000"
+    ) == ("noaa-gfs-bdp-pds", "gfs.20770101/00/atmos/gfs.t00z.pgrb2.0p25.f000")
+    assert dld.parse_s3_url("s3://bucket") == ("bucket", "")
+    with pytest.raises(ValueError, match="Invalid S3 url: https://bucket/key"):
+        dld.parse_s3_url("https://bucket/key")
+
+
+class StubS3Client:
+    """S3 client that lists fixed keys, or raises an error for a bucket."""
+
+    def __init__(self, keys, errors=None):
+        """Store the keys of each bucket and the errors to raise."""
+        self.keys = keys
+        self.errors = errors or {}
+
+    def get_paginator(self, operation_name):
+        """Return itself as a list_objects_v2 paginator."""
+        assert operation_name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):  # pylint: disable=invalid-name
+        """Yield one page of the keys in Bucket that start with Prefix."""
+        if Bucket in self.errors:
+            raise self.errors[Bucket]
+        yield {"Contents": [
+            {"Key": key} for key in self.keys.get(Bucket, [])
+            if key.startswith(Prefix)
+        ]}
+
+
+def test_get_available_files(monkeypatch):
+    """Test get_available_files keeps only listed files.
+
+    A bucket that cannot be listed counts as having no files yet.
+    """
+    urls = dld.get_urls("20770101", "00")
+    gfs_src = f"{urls['gfs']}/gfs.t00z.pgrb2.0p25.f%03d"
+    gefs_src = f"{urls['gefs']}/gefs.chem.t00z.a2d_0p25.f%03d.grib2"
+    pending = {
+        f"gfs.f{hour:03d}": (gfs_src % hour, f"gfs.f{hour:03d}")
+        for hour in range(3)
+    }
+    pending["gefs.f000"] = (gefs_src % 0, "gefs.f000")
+    keys = {
+        "noaa-gfs-bdp-pds": [
+            dld.parse_s3_url(gfs_src % hour)[1] for hour in (0, 2)
+        ],
+        "noaa-gefs-pds": [dld.parse_s3_url(gefs_src % 0)[1]],
+    }
+
+    monkeypatch.setattr(dld, "S3_CLIENT", StubS3Client(keys))
+    assert dld.get_available_files(pending, urls) == [
+        pending["gfs.f000"], pending["gfs.f002"], pending["gefs.f000"]
+    ]
+
+    errors = {
+        "noaa-gfs-bdp-pds": EndpointConnectionError(
+            endpoint_url="https://noaa-gfs-bdp-pds.s3.amazonaws.com"
+        ),
+        "noaa-gefs-pds": ClientError(
+            {"Error": {"Code": "AccessDenied", "Message": "Access Denied"}},
+            "ListObjectsV2"
+        ),
+    }
+    monkeypatch.setattr(dld, "S3_CLIENT", StubS3Client(keys, errors))
+    assert dld.get_available_files(pending, urls) == []
+
+
 # ----------------------------------------------------------------------------
 # Test downloader and download_data with localhost and simplified code.
 # ----------------------------------------------------------------------------
 
-rate_limiter = RateLimiter(max_calls=5, period=5)
-
-
 def downloader_simple(num, file_list):
     """Download a dataset from src_url to dest_dir.
 
     This is a worker thread that downloads only one file.
     """
-    with rate_limiter:
-        try:
-            response = requests.get("http://localhost:8000", timeout=3)
-            print(
-                f"Downloader {num} compelete. Status {response.status_code}"
-            )
-            file_list.remove(num)
-        except subprocess.CalledProcessError as error:
-            print(f"Error occurred: {error.output.decode('utf-8')}")
-        except Exception as error:
-            print(f"Unexpected error: {error}")
+    try:
+        response = requests.get("http://localhost:8000", timeout=3)
+        print(
+            f"Downloader {num} compelete. Status {response.status_code}"
+        )
+        file_list.remove(num)
+    except subprocess.CalledProcessError as error:
+        print(f"Error occurred: {error.output.decode('utf-8')}")
+    except Exception as error:
+        print(f"Unexpected error: {error}")
 
 
 def download_data_simple(file_list):
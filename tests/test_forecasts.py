@@ -1,201 +1,258 @@
 """Test cloud.py in dataserver/api module."""
 import os
+import re
 import shutil
-from datetime import datetime
+from datetime import datetime, timedelta
+import ephem
+import numpy as np
+import pytest
 import pytz
-from dataserver.api.utilities import get_directory, \
-    get_forecast_type_and_hour, is_moon_free
-from dataserver.api.forecasts import get_moon_activity
+from dataserver.api.utilities import get_directory, DIRECTORY_CACHE, \
+    get_forecast_type_and_hour, create_observer, get_moon_free_intervals, \
+    get_moon_free_mask, get_all_object_activity, parse_date, \
+    parse_date_time, parse_timestamp, DAYS_OF_ACTIVITY
+from dataserver.api.forecasts import get_forecasts, HOURS_OF_PREDICTION
+from dataserver.process import stack_forecasts, FORECAST_TYPES
 
 
-def clean_directory():
-    """Remove testing directories, if there are any."""
-    if os.path.exists("data/30770615"):
-        shutil.rmtree("data/30770615")
-    if os.path.exists("data/30770616"):
-        shutil.rmtree("data/30770616")
-    if os.path.exists("data/30770617"):
-        shutil.rmtree("data/30770617")
-
-
-def test_get_directory():
+def test_get_directory(isolated_data):
     """Test get_directory function."""
-    clean_directory()
-    # Case 1: available data 30770615, 30770616, and 30770617 up to 12.
-    # 30770617/18 folder does not exist.
-    os.makedirs("data/30770617/12/complete.flag")  # previous data don't matter
-    # Request is made on 30770617. Should return 30770617/12/gfs(gefs)
-    assert get_directory("gfs", "30770617") == \
-        ("data/30770617/12/gfs", "3077061712")
-    assert get_directory("gefs", "30770617") == \
-        ("data/30770617/12/gefs", "3077061712")
-    # Request is made on 30770618. Should also return 30770617/12/gfs(gefs)
-    assert get_directory("gfs", "30770618") == \
-        ("data/30770617/12/gfs", "3077061712")
-    assert get_directory("gefs", "30770618") == \
-        ("data/30770617/12/gefs", "3077061712")
-
-    # Case 2: available data 30770615, 30770616, and 30770617 up to 12.
-    # 30770617/18 folder exists but does not have completion flag.
-    os.makedirs("data/30770617/18")
-    # Request is made on 30770617. Should return 30770617/12/gfs(gefs)
-    assert get_directory("gfs", "30770617") == \
-        ("data/30770617/12/gfs", "3077061712")
-    assert get_directory("gefs", "30770617") == \
-        ("data/30770617/12/gefs", "3077061712")
-    # Request is made on 30770618. Should also return 30770617/12/gfs(gefs)
-    assert get_directory("gfs", "30770618") == \
-        ("data/30770617/12/gfs", "3077061712")
-    assert get_directory("gefs", "30770618") == \
-        ("data/30770617/12/gefs", "3077061712")
-
-    # Case 3: available data 30770615, 30770616, 30770617.
-    os.makedirs("data/30770617/18/complete.flag")
-    # Request is made on 30770617. Should return 30770617/18/gfs(gefs)
-    assert get_directory("gfs", "30770617") == \
-        ("data/30770617/18/gfs", "3077061718")
-    assert get_directory("gefs", "30770617") == \
-        ("data/30770617/18/gefs", "3077061718")
-    # Request is made on 30770618. Should return 30770617/18/gfs(gefs)
-    assert get_directory("gfs", "30770618") == \
-        ("data/30770617/18/gfs", "3077061718")
-    assert get_directory("gefs", "30770618") == \
-        ("data/30770617/18/gefs", "3077061718")
+    # Runs found by get_directory are cached.
+    DIRECTORY_CACHE.clear()
+    # Each case creates one more directory and expects the latest complete
+    # run: (directory to create, (run date, run time)).
+    cases = [
+        # Case 1: available data 30770615, 30770616, and 30770617 up to 12.
+        # 30770617/18 folder does not exist. Previous data don't matter.
+        ("data/30770617/12/complete.flag", ("30770617", "12")),
+        # Case 2: available data 30770615, 30770616, and 30770617 up to 12.
+        # 30770617/18 folder exists but does not have completion flag.
+        ("data/30770617/18", ("30770617", "12")),
+        # Case 3: available data 30770615, 30770616, 30770617.
+        ("data/30770617/18/complete.flag", ("30770617", "18")),
+    ]
+    for path, (run_date, run_time) in cases:
+        os.makedirs(path)
+        DIRECTORY_CACHE.clear()
+        # Requests made on the day of the run and on the next day should
+        # both return the run.
+        for query_date in ("30770617", "30770618"):
+            for data_type in ("gfs", "gefs"):
+                assert get_directory(data_type, query_date) == (
+                    f"data/{run_date}/{run_time}/{data_type}",
+                    f"{run_date}{run_time}"
+                )
 
     # Error handling: data_type incorrect.
-    try:
+    with pytest.raises(ValueError, match=re.escape(
+            "Invalid data_type: nba. Expected 'gfs' or 'gefs'")):
         get_directory("nba", "30770617")
-    except ValueError as error:
-        assert str(error) == "Invalid data_type: nba. " \
-                             "Expected \'gfs\' or \'gefs\'"
-        print(error)
 
     # Error handling: no data available.
-    clean_directory()
-    try:
+    shutil.rmtree(isolated_data / "30770617")
+    DIRECTORY_CACHE.clear()
+    with pytest.raises(FileNotFoundError,
+                       match="Cannot find processed NOAA datasets."):
         get_directory("gfs", "30770617")
-    except FileNotFoundError as error:
-        assert str(error) == "Cannot find processed NOAA datasets."
-        print(error)
 
 
-def test_get_forecast_hour():
+@pytest.mark.parametrize("filename, expected", [
+    ("cloud.f000.npy", ("cloud", 0)),
+    ("humidity.f007.npy", ("humidity", 7)),
+    ("aerosol.f071.npy", ("aerosol", 71)),
+])
+def test_get_forecast_hour(filename, expected):
     """Test get_forecast_type_and_hour function."""
-    assert get_forecast_type_and_hour("cloud.f000.npy") == ("cloud", 0)
-    assert get_forecast_type_and_hour("humidity.f007.npy") == ("humidity", 7)
-    assert get_forecast_type_and_hour("aerosol.f071.npy") == ("aerosol", 71)
+    assert get_forecast_type_and_hour(filename) == expected
 
 
-def convert_time_to_utc(time_dt, input_timezone):
-    """Convert input_time from input_timezone to UTC.
+@pytest.mark.parametrize("data_type", ["gfs", "gefs"])
+def test_get_forecasts_stacked(isolated_data, data_type):
+    """Test get_forecasts reads the same series before and after stacking."""
+    DIRECTORY_CACHE.clear()
+    run_directory = isolated_data / "30770617" / "12"
+    directory = run_directory / data_type
+    directory.mkdir(parents=True)
+    (run_directory / "complete.flag").touch()
+    # (89.5, -179.25) is the point (2, 3) of the grid, so small grids do.
+    lat, lng = 89.5, -179.25
+    forecast_types, hour_step = FORECAST_TYPES[data_type]
+    hours = range(0, HOURS_OF_PREDICTION, hour_step)
+    for forecast_type in forecast_types:
+        for hour in hours:
+            grid = np.arange(20, dtype=np.float32).reshape(4, 5) + hour
+            np.save(directory / f"{forecast_type}.f{hour:03d}.npy", grid)
+    # Forecasts between two files repeat the earlier one.
+    expected = np.repeat(
+        [13.0 + hour for hour in hours], hour_step
+    )[:HOURS_OF_PREDICTION]
+
+    hourly = get_forecasts(lat, lng, data_type, "30770617")
+    for forecast_type in forecast_types:
+        stack_forecasts(str(directory), forecast_type, hour_step)
+    assert sorted(os.listdir(directory)) == sorted(
+        f"{forecast_type}.npy" for forecast_type in forecast_types
+    )
+    stacked = get_forecasts(lat, lng, data_type, "30770617")
+
+    assert hourly["timestamp"] == stacked["timestamp"] == "3077061712"
+    for forecast_type in forecast_types:
+        np.testing.assert_array_equal(hourly[forecast_type], expected)
+        np.testing.assert_array_equal(stacked[forecast_type], expected)
+
+    with pytest.raises(ValueError, match=re.escape(
+            "Invalid data_type: nba. Expected 'gfs' or 'gefs'")):
+        get_forecasts(lat, lng, "nba", "30770617")
 
-    Parameters:
-    time_dt - a datetime object of format YYYY/MM/DD HH:MM:SS
-    input_timezone - a STRING representing a valid timezone.
-                     e.g. America/Detroit
-    """
-    # pytz will throw exceptions if input_timezone is invalid.
-    timezone = pytz.timezone(input_timezone)
 
-    # Add timezone info to the datetime object.
-    local_time = timezone.localize(time_dt)
+def test_parse_helpers():
+    """Test fixed-format parsers against datetime.strptime."""
+    assert parse_date("2023/07/01") == \
+        datetime.strptime("2023/07/01", "%Y/%m/%d")
+    assert parse_date_time("2023/07/01 21:15") == \
+        datetime.strptime("2023/07/01 21:15", "%Y/%m/%d %H:%M")
+    assert parse_timestamp("2023071118") == \
+        datetime.strptime("2023071118", "%Y%m%d%H")
 
-    utc_time = local_time.astimezone(pytz.UTC)
-    return utc_time
 
+ANN_ARBOR = (42.2776, -83.7409)
+DETROIT = pytz.timezone("America/Detroit")
 
-# pylint: disable=R0914
-def test_is_moon_free():
-    """Test is_moon_free function.
 
-    Ground truth: on July 1 2023, at location (42.2776, -83.7409), the moon
-    sets at 3:47 am and rises at 7:58 pm.
+def get_hour_starts(start_dt, hours):
+    """Return POSIX timestamps of `hours` hours starting at start_dt."""
+    return np.array([
+        (start_dt + timedelta(hours=hour)).timestamp()
+        for hour in range(hours)
+    ])
+
+
+def test_get_moon_free_intervals():
+    """Test moon-free periods on July 1 2023 in Ann Arbor.
+
+    Ground truth: the moon sets at 3:48 am and rises at 7:58 pm.
     """
-    lat = 42.2776
-    lng = -83.7409
-    time_format = "%Y/%m/%d %H:%M:%S"
-    timezone = "America/Detroit"
-    # Case 1: 3 am - should return False.
-    time_3_am = datetime.strptime(
-        "2023/07/01 03:00:00", time_format
+    intervals = get_moon_free_intervals(
+        create_observer(*ANN_ARBOR), ephem.Moon(),
+        DETROIT.localize(datetime(2023, 7, 1)),
+        DETROIT.localize(datetime(2023, 7, 2))
     )
-    time_3_am_utc = convert_time_to_utc(time_3_am, timezone)
-    assert not is_moon_free(lat, lng, time_3_am_utc)
+    assert len(intervals) == 1
+    moonset_dt, moonrise_dt = intervals[0]
+    assert moonset_dt.utcoffset() == moonrise_dt.utcoffset() == timedelta(0)
+    assert moonset_dt.astimezone(DETROIT).strftime("%H:%M") == "03:48"
+    assert moonrise_dt.astimezone(DETROIT).strftime("%H:%M") == "19:58"
 
-    # Case 2: 4 am - should return True.
-    time_4_am = datetime.strptime(
-        "2023/07/01 04:00:00", time_format
+    # Only hours that start after moonset and end before moonrise are
+    # moon-free: 4 am to 7 pm.
+    moon_free = get_moon_free_mask(
+        intervals, get_hour_starts(DETROIT.localize(datetime(2023, 7, 1)), 24)
     )
-    time_4_am_utc = convert_time_to_utc(time_4_am, timezone)
-    assert is_moon_free(lat, lng, time_4_am_utc)
+    assert np.flatnonzero(moon_free).tolist() == list(range(4, 19))
 
-    # Case 3: 6 pm - should return True.
-    time_6_pm = datetime.strptime(
-        "2023/07/01 18:00:00", time_format
-    )
-    time_6_pm_utc = convert_time_to_utc(time_6_pm, timezone)
-    assert is_moon_free(lat, lng, time_6_pm_utc)
-
-    # Case 4: 7 pm - should return False.
-    # NOTE: this test case doesn't really work, and the inconsistency appears
-    # to lie within the ephem library - calculated next_rising time is indeed
-    # 19:58:23 but alitude at 8 pm is slightly less than 0.
-    # This error margin is acceptable.
-
-    # Case 5: 8 pm - should return False.
-    time_8_pm = datetime.strptime(
-        "2023/07/01 20:00:00", time_format
-    )
-    time_8_pm_utc = convert_time_to_utc(time_8_pm, timezone)
-    assert not is_moon_free(lat, lng, time_8_pm_utc)
 
-    # Case 6: no timezone info - should throw an error.
-    time_no_tz = datetime.strptime(
-        "2023/07/01 20:00:00", time_format
+def test_get_moon_free_mask_edges():
+    """Test hours that start or end exactly at interval edges."""
+    moonset_dt = datetime(2077, 1, 1, 3, tzinfo=pytz.UTC)
+    moonrise_dt = datetime(2077, 1, 1, 6, tzinfo=pytz.UTC)
+    start_times = get_hour_starts(datetime(2077, 1, 1, tzinfo=pytz.UTC), 8)
+    assert get_moon_free_mask(
+        [(moonset_dt, moonrise_dt)], start_times
+    ).tolist() == [False] * 3 + [True] * 3 + [False] * 2
+    # One second more and the hour before moonrise is not moon-free.
+    assert get_moon_free_mask(
+        [(moonset_dt, moonrise_dt)], start_times[5:6] + 1
+    ).tolist() == [False]
+    assert get_moon_free_mask([], start_times).tolist() == [False] * 8
+
+
+def test_get_moon_free_mask_limb():
+    """Test that moonrise counts from the upper limb of the moon.
+
+    On July 1 2023 in Ann Arbor the moon rises at 7:58 pm, but its center is
+    still below the horizon at 8 pm. The hour from 7 pm is not moon-free,
+    although the center of the moon is below the horizon all along.
+    """
+    observer, moon = create_observer(*ANN_ARBOR), ephem.Moon()
+    start_dt = DETROIT.localize(datetime(2023, 7, 1, 19))
+    for hour_dt in (start_dt, start_dt + timedelta(hours=1)):
+        observer.date = hour_dt.astimezone(pytz.UTC)
+        moon.compute(observer)
+        assert moon.alt < 0
+
+    intervals = get_moon_free_intervals(
+        observer, moon, DETROIT.localize(datetime(2023, 7, 1)),
+        DETROIT.localize(datetime(2023, 7, 2))
     )
-    try:
-        is_moon_free(lat, lng, time_no_tz)
-    except ValueError as error:
-        print(error)
-        assert error.args[0] == "Input time should be in UTC timezone."
-
-    # Case 7: not UTC timezone - should throw an error.
-    time_wrong_tz = datetime.strptime(
-        "2023/07/01 20:00:00", time_format
+    assert get_moon_free_mask(
+        intervals, get_hour_starts(start_dt, 1)
+    ).tolist() == [False]
+
+
+@pytest.mark.parametrize("start_dt, moon_free", [
+    # The moon stays below the horizon all day.
+    (datetime(2023, 6, 1, tzinfo=pytz.UTC), True),
+    # The moon stays above the horizon all day.
+    (datetime(2023, 6, 15, tzinfo=pytz.UTC), False),
+])
+def test_get_moon_free_intervals_circumpolar(start_dt, moon_free):
+    """Test a moon that never rises or never sets in Longyearbyen."""
+    end_dt = start_dt + timedelta(days=1)
+    intervals = get_moon_free_intervals(
+        create_observer(78.2, 15.6), ephem.Moon(), start_dt, end_dt
     )
-    wrong_timezone = pytz.timezone("America/Detroit")
-    time_wrong_tz = wrong_timezone.localize(time_wrong_tz)
-    try:
-        is_moon_free(lat, lng, time_wrong_tz)
-    except ValueError as error:
-        print(error)
-        assert error.args[0] == "Input time should be in UTC timezone."
-
-    # Case 8: not rounded to the nearest hour - should throw an error.
-    time_not_rounded = datetime.strptime(
-        "2023/07/01 18:46:00", time_format
+    assert intervals == ([(start_dt, end_dt)] if moon_free else [])
+    assert get_moon_free_mask(
+        intervals, get_hour_starts(start_dt, 24)
+    ).tolist() == [moon_free] * 24
+
+
+def test_get_all_object_activity():
+    """Test activities of the sun, the moon, and the Milky Way.
+
+    Ground truth: from July 1 2023 in Ann Arbor, the moon sets at 3:48,
+    4:37, 5:40, 6:56 am and rises at 7:58, 9:08, 10:09, 10:56 pm.
+    """
+    context = {"dark_hours": [], "moon_activity": [], "milky_way": {}}
+    context["milky_way"]["activity"] = []
+    dark_hours, moon_free_intervals = get_all_object_activity(
+        context, create_observer(*ANN_ARBOR), DETROIT, "2023/07/01"
     )
-    utc_time_not_rounded = convert_time_to_utc(time_not_rounded, timezone)
-    try:
-        is_moon_free(lat, lng, utc_time_not_rounded)
-    except ValueError as error:
-        print(error)
-        assert error.args[0] == \
-            "Input time should be rounded to the nearest hour."
-
-
-def test_get_moon_activity():
-    """Test function `get_moon_activity`."""
-    # Create a simple `context` dictionary.
-    context = {
-        "data": {
-            "2023/07/01": None
-        },
-        "lat": 42.2776,
-        "lng": -83.7409,
-        "timezone": "America/Detroit"
-    }
-
-    get_moon_activity(context)
-
-    print(context["moon_phase"])
+
+    assert [
+        (moon["set"], moon["rise"]) for moon in context["moon_activity"]
+    ] == [
+        ("2023/07/01 03:48", "2023/07/01 19:58"),
+        ("2023/07/02 04:37", "2023/07/02 21:08"),
+        ("2023/07/03 05:40", "2023/07/03 22:09"),
+        ("2023/07/04 06:56", "2023/07/04 22:56"),
+    ]
+    assert len(context["dark_hours"]) == DAYS_OF_ACTIVITY
+    assert len(context["milky_way"]["activity"]) == DAYS_OF_ACTIVITY
+    for day in range(DAYS_OF_ACTIVITY):
+        date = f"2023/07/{day + 1:02d}"
+        sun = context["dark_hours"][day]
+        # Sunset is in the evening of each date, followed by sunrise.
+        assert sun["set"].startswith(f"{date} 21:")
+        assert parse_date_time(sun["set"]) < parse_date_time(sun["rise"])
+        assert dark_hours[day] == (
+            parse_date_time(sun["set"]), parse_date_time(sun["rise"])
+        )
+        milky_way = context["milky_way"]["activity"][day]
+        assert milky_way["rise"].startswith(date)
+        assert parse_date_time(milky_way["rise"]) < \
+            parse_date_time(milky_way["transit"]) < \
+            parse_date_time(milky_way["set"])
+
+    # The moon rises in each evening and sets in the next morning before
+    # sunrise. Moon-free periods from the first sunset on start at those
+    # moonsets; the one that ends on July 1 at 7:58 pm is left out.
+    assert [
+        (moonset_dt.astimezone(DETROIT).strftime("%m/%d %H:%M"),
+         moonrise_dt.astimezone(DETROIT).strftime("%m/%d %H:%M"))
+        for moonset_dt, moonrise_dt in moon_free_intervals
+    ] == [
+        ("07/02 04:37", "07/02 21:08"),
+        ("07/03 05:40", "07/03 22:09"),
+        ("07/04 06:56", "07/04 22:56"),
+    ]
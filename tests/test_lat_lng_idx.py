@@ -2,6 +2,7 @@
 
 For 0p25 resolution, matrix shape is (721, 1440).
 """
+import pytest
 from dataserver.model import get_lat_idx, get_lng_idx
 
 
@@ -31,15 +32,11 @@ def test_lat_idx():
     assert get_lat_idx(0.125) == 359
     assert get_lat_idx(-0.125) == 360
 
-    try:
+    with pytest.raises(ValueError):
         get_lat_idx(90.01)
-    except ValueError as error:
-        print(f"Caught ValueError {error}")
 
-    try:
+    with pytest.raises(ValueError):
         get_lat_idx(-100)
-    except ValueError as error:
-        print(f"Caught ValueError {error}")
 
 
 def test_lng_idx():
@@ -70,12 +67,8 @@ def test_lng_idx():
     # equal distance - index 720
     assert get_lng_idx(0.125) == 720
 
-    try:
+    with pytest.raises(ValueError):
         get_lng_idx(-200)
-    except ValueError as error:
-        print(f"Caught ValueError {error}")
 
-    try:
+    with pytest.raises(ValueError):
         get_lng_idx(360)
-    except ValueError as error:
-        print(f"Caught ValueError {error}")
@@ -0,0 +1,54 @@
+"""Test the logger shared by the data server."""
+import os
+import time
+from logging.handlers import QueueHandler, WatchedFileHandler
+import pytest
+from dataserver.logger import setup_logger
+
+
+def read_when_logged(log_file, messages, timeout=5):
+    """Return lines of log_file once all messages are in it.
+
+    The main process writes records from a background thread.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        lines = log_file.read_text(encoding="utf-8").splitlines() \
+            if log_file.exists() else []
+        if all(any(message in line for line in lines)
+               for message in messages) or time.monotonic() > deadline:
+            return lines
+        time.sleep(0.05)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_log_from_forked_child(tmp_path):
+    """Test a forked child writes its records without the queue listener."""
+    log_file = tmp_path / "fork.log"
+    fork_logger = setup_logger(str(log_file), "tests.fork")
+    assert any(isinstance(handler, QueueHandler)
+               for handler in fork_logger.handlers)
+    fork_logger.info("from parent")
+
+    pid = os.fork()
+    if pid == 0:
+        # Nothing in the child may raise into pytest, so report by status.
+        status = 1
+        try:
+            handlers = fork_logger.handlers
+            if not any(isinstance(handler, QueueHandler)
+                       for handler in handlers) and \
+                    any(isinstance(handler, WatchedFileHandler)
+                        for handler in handlers):
+                fork_logger.info("from child")
+                status = 0
+        finally:
+            os._exit(status)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    lines = read_when_logged(log_file, ("from parent", "from child"))
+    assert any(line.endswith("tests.fork - INFO - from child")
+               for line in lines)
+    assert any(line.endswith("tests.fork - INFO - from parent")
+               for line in lines)
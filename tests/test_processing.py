@@ -1,28 +1,42 @@
 """Test data processing functions."""
 import os
-import shutil
 import numpy as np
+import pytest
 from dataserver.process import process_gfs_file, process_gefs_file, \
-    delete_stale_data
+    delete_stale_data, DATA_RETENTION_DAYS
+from bin.test_files_create import link_or_copy
 
 
 HEIGHT, WIDTH = 721, 1440
+# Raw NOAA files used as fixtures. Tests run in a temporary working
+# directory, so the path is absolute.
+FIXTURE_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data", "20230613"
+)
 
 
-def clean_tmp_directory():
-    """Remove a directory."""
-    if os.path.exists("tmp/20770101"):
-        shutil.rmtree("tmp/20770101")
+def link_files(source_directory, destination_directory):
+    """Hard-link the files in source_directory into destination_directory.
 
+    Processing only reads and then deletes raw files, so a hard link leaves
+    the fixtures intact without copying their bytes.
+    """
+    with os.scandir(source_directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                link_or_copy(
+                    entry.path, os.path.join(destination_directory, entry.name)
+                )
 
+
+@pytest.mark.usefixtures("isolated_data")
 def test_process_gfs_file():
     """Test process_gfs_file which processes one GFS file."""
     # Create a temporary directory that stores a GFS file.
-    clean_tmp_directory()
-
     os.makedirs("tmp/20770101/12/gfs")
-    # Copy the file into the directory.
-    os.system("cp data/20230613/* tmp/20770101/12/gfs/")
+    # Link the files into the directory.
+    link_files(FIXTURE_DIRECTORY, "tmp/20770101/12/gfs")
 
     file_path = "tmp/20770101/12/gfs/gfs.t12z.pgrb2.0p25.f004"
     assert os.path.exists(file_path)
@@ -45,20 +59,15 @@ def test_process_gfs_file():
     assert np.sum(np.isnan(cloud_data)) < HEIGHT * WIDTH
     assert np.sum(np.isnan(humidity_data)) < HEIGHT * WIDTH
 
-    # Remove the temporary directory.
-    shutil.rmtree("tmp/20770101")
-
 
+@pytest.mark.usefixtures("isolated_data")
 def test_process_gefs_file():
     """Test the function that processes one GEFS file."""
-    clean_tmp_directory()
     tmp_path = "tmp/20770101/12/gefs"
     filename = "gefs.chem.t12z.a2d_0p25.f000.grib2"
     os.makedirs(tmp_path)
-    # Copy GEFS files to tmp_path.
-    os.system(
-        f"cp data/20230613/{filename} {tmp_path}"
-    )
+    # Link the GEFS file into tmp_path.
+    link_or_copy(f"{FIXTURE_DIRECTORY}/{filename}", f"{tmp_path}/{filename}")
     assert os.path.exists(f"{tmp_path}/{filename}")
     process_gefs_file(f"{tmp_path}/{filename}")
     # Raw file should be gone.
@@ -73,33 +82,34 @@ def test_process_gefs_file():
     assert np.sum(np.isnan(fine_data)) < HEIGHT * WIDTH
     assert np.sum(np.isnan(coarse_data)) < HEIGHT * WIDTH
 
-    shutil.rmtree("tmp/20770101")
-
 
 def count_file_lines(filename):
-    """Count number of lines a file has."""
-    line_count = 0
-    with open(filename, "r", encoding="utf-8") as file:
-        for _ in file:
-            line_count += 1
-    return line_count
-
-
-def test_delete_stale_data():
-    """Test delete_stale_data function."""
-    os.mkdir("data/30770101")
-    os.mkdir("data/30770102")
-    os.mkdir("data/30770103")
-    os.mkdir("data/30770104")
-    assert os.path.exists("data/30770101")
+    """Count number of lines a file has.
+
+    Newline bytes are counted in binary chunks instead of iterating over
+    decoded lines. A last line without a newline also counts.
+    """
+    line_count, last_chunk = 0, b"\n"
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            line_count += chunk.count(b"\n")
+            last_chunk = chunk
+    return line_count + (not last_chunk.endswith(b"\n"))
+
+
+def test_delete_stale_data(isolated_data):
+    """Test delete_stale_data deletes data DATA_RETENTION_DAYS days ago."""
+    for date in ("30770101", "30770102", "30770103", "30770104"):
+        (isolated_data / date).mkdir()
+    assert DATA_RETENTION_DAYS == 2
     delete_stale_data("30770104")
-    assert not os.path.exists("data/30770101")
-    assert os.path.exists("data/30770102")
+    # Only the directory of the date DATA_RETENTION_DAYS days ago goes.
+    assert not os.path.exists("data/30770102")
+    assert os.path.exists("data/30770101")
     assert os.path.exists("data/30770103")
-    assert os.path.exists("data/30770102")
-    os.rmdir("data/30770102")
-    os.rmdir("data/30770103")
-    os.rmdir("data/30770104")
+    assert os.path.exists("data/30770104")
+    # A missing directory is not an error.
+    delete_stale_data("30770104")
 
 
 if __name__ == "__main__":
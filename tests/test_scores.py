@@ -0,0 +1,151 @@
+"""Test stargazing scores in dataserver/api module."""
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+import pytz
+from dataserver.api import forecasts
+from dataserver.api.forecasts import SCORE_TABLE, compute_score_forecast
+from dataserver.api.utilities import compute_night_scores, score_hours, \
+    compute_final_score, format_date
+
+
+DETROIT = pytz.timezone("America/Detroit")
+# Hours of the night from July 1 2023 10 pm to July 2 5 am, local time.
+NIGHT = [datetime(2023, 7, 1, 22) + timedelta(hours=hour) for hour in range(8)]
+# Transparency of 1 to 5 maps to the score table column 4 to 0.
+TRANSPARENCY_SCORES = (None, 4, 3, 2, 1, 0)
+
+
+def create_context(hours_dt, transparencies):
+    """Return a forecast context with transparency of the given hours."""
+    context = {"timezone": "America/Detroit", "lat": 42.2776,
+               "lng": -83.7409, "data": {}}
+    for hour_dt, transparency in zip(hours_dt, transparencies):
+        context["data"].setdefault(format_date(hour_dt), {})[
+            f"{hour_dt.hour:02d}"
+        ] = {"transparency": transparency}
+    return context
+
+
+def moon_free_between(start_dt, end_dt):
+    """Return moon-free intervals of one period between local times."""
+    return [(DETROIT.localize(start_dt).astimezone(pytz.UTC),
+             DETROIT.localize(end_dt).astimezone(pytz.UTC))]
+
+
+@pytest.mark.parametrize("light_pollution_score, transparency, expected", [
+    (0, 5, 4),
+    (0, 4, 3),
+    (1, 5, 3),
+    (1, 3, 2),
+    (2, 3, 1),
+    (3, 5, 1),
+])
+def test_score_hours_table(light_pollution_score, transparency, expected):
+    """Test moon-free hours are looked up in SCORE_TABLE."""
+    assert SCORE_TABLE[
+        light_pollution_score, TRANSPARENCY_SCORES[transparency]
+    ] == expected
+    scores, is_scored = score_hours(
+        np.array([True]), np.array([transparency]), light_pollution_score,
+        SCORE_TABLE
+    )
+    assert scores.tolist() == [expected]
+    assert is_scored.tolist() == [True]
+
+
+def test_score_hours_moon_up():
+    """Test hours with the moon up score 1, with or without data."""
+    scores, is_scored = score_hours(
+        np.array([False, False, True, True]), np.array([5, 0, 5, 0]), 0,
+        SCORE_TABLE
+    )
+    assert scores[is_scored].tolist() == [1, 1, 4]
+    # A moon-free hour without data is not scored.
+    assert is_scored.tolist() == [True, True, True, False]
+
+
+def test_compute_night_scores():
+    """Test scores of a night when the moon rises at 1:30 am."""
+    context = create_context(NIGHT, [5, 4, 3, 5, 5, 5, 5, 5])
+    moonrise_dt = datetime(2023, 7, 2, 1, 30)
+    scores = compute_night_scores(
+        context, NIGHT, 0, SCORE_TABLE,
+        moon_free_between(datetime(2023, 7, 1, 12), moonrise_dt)
+    )
+    # 1 am to 2 am is not moon-free.
+    assert scores == [4, 3, 2, 1, 1, 1, 1, 1]
+
+    # Hours without data are skipped.
+    del context["data"]["2023/07/02"]["03"]
+    assert compute_night_scores(
+        context, NIGHT, 0, SCORE_TABLE, []
+    ) == [1] * 8
+    assert compute_night_scores(
+        context, NIGHT, 0, SCORE_TABLE,
+        moon_free_between(datetime(2023, 7, 1, 12), datetime(2023, 7, 2, 12))
+    ) == [4, 3, 2, 4, 4, 4, 4]
+
+
+def test_compute_score_forecast_night_window(monkeypatch):
+    """Test only whole hours between sunset and sunrise are scored."""
+    monkeypatch.setattr(
+        forecasts, "get_light_pollution_score", lambda *_: 1
+    )
+    scored_hours = []
+
+    def record_hours(context, hours_dt, *args):
+        """Record the scored hours before scoring them."""
+        scored_hours.extend(hours_dt)
+        return compute_night_scores(context, hours_dt, *args)
+
+    monkeypatch.setattr(forecasts, "compute_night_scores", record_hours)
+    # Forecasts from 6 pm to 8 am.
+    context = create_context(
+        [datetime(2023, 7, 1, 18) + timedelta(hours=hour)
+         for hour in range(15)], [5] * 15
+    )
+    compute_score_forecast(
+        context, None,
+        [(datetime(2023, 7, 1, 21, 15), datetime(2023, 7, 2, 6, 2))],
+        moon_free_between(datetime(2023, 7, 1, 12), datetime(2023, 7, 2, 12))
+    )
+    assert scored_hours == NIGHT
+    assert context["score"] == "A"
+
+
+def score_hour_reference(context, hour_dt, moon_free, light_pollution_score):
+    """Score one hour the way hours were scored one at a time."""
+    if not moon_free:
+        return 1
+    date, hour = format_date(hour_dt), f"{hour_dt.hour:02d}"
+    transparency = int(context["data"][date][hour]["transparency"])
+    return int(SCORE_TABLE[
+        light_pollution_score, TRANSPARENCY_SCORES[transparency]
+    ])
+
+
+@pytest.mark.parametrize("transparencies, moonrise_hour, expected", [
+    ([5, 5, 5, 4, 4, 3, 2, 1], 8, "S"),
+    ([5, 5, 4, 4, 3, 3, 3, 3], 3, "A"),
+    ([4, 4, 4, 4, 4, 5, 5, 5], 0, "C"),
+    ([3, 3, 3, 3, 3, 3, 3, 3], 8, "B"),
+])
+def test_compute_final_score(transparencies, moonrise_hour, expected):
+    """Test final scores match scores computed hour by hour.
+
+    The moon is up from the hour `moonrise_hour` of the night.
+    """
+    context = create_context(NIGHT, transparencies)
+    moonrise_dt = NIGHT[0] + timedelta(hours=moonrise_hour)
+    scores = compute_night_scores(
+        context, NIGHT, 0, SCORE_TABLE,
+        moon_free_between(datetime(2023, 7, 1, 12), moonrise_dt)
+    )
+    reference = [
+        score_hour_reference(context, hour_dt, hour_dt < moonrise_dt, 0)
+        for hour_dt in NIGHT
+    ]
+    assert scores == reference
+    assert compute_final_score(scores) == compute_final_score(reference) \
+        == expected
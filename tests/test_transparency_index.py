@@ -0,0 +1,22 @@
+"""Test cloud, humidity, and aerosol values to table index translations."""
+import numpy as np
+import pytest
+from dataserver.model import get_cloud_humidity_index, get_aerosol_index, \
+    get_cloud_humidity_indices, get_aerosol_indices
+
+
+def test_cloud_humidity_indices():
+    """Test array version agrees with scalar version, including NaN."""
+    percentages = [0, 19.99, 20, 39.99, 40, 100, np.nan]
+    expected = [get_cloud_humidity_index(each) for each in percentages]
+    assert get_cloud_humidity_indices(percentages).tolist() == expected
+
+    with pytest.raises(ValueError):
+        get_cloud_humidity_indices([10, 101])
+
+
+def test_aerosol_indices():
+    """Test array version agrees with scalar version, including NaN."""
+    aerosols = [0, 0.099, 0.1, 0.299, 0.3, 5, np.nan]
+    expected = [get_aerosol_index(each) for each in aerosols]
+    assert get_aerosol_indices(aerosols).tolist() == expected